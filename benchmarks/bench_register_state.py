@@ -0,0 +1,161 @@
+"""
+Benchmarks for the `RegisterState` read/write hot paths, run against
+`SimulatedRegisterState` so no hardware is needed.
+
+Run as ``python benchmarks/bench_register_state.py``.  Each line reports the
+wall time, the peak Python memory allocated (from `tracemalloc`), and the
+number of bus transactions, all per operation.  Use ``--json`` to save the
+results for comparing across releases.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from stateful_registers import (RegisterValue, MultiRegisterValue,
+                                RegisterMap, SimulatedRegisterState)
+
+
+def load_bme280():
+    fn = os.path.join(os.path.dirname(__file__), os.pardir, 'examples',
+                      'bme280.py')
+    spec = importlib.util.spec_from_file_location('bme280', fn)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def synthetic_registers(naddresses):
+    """
+    Two 4-bit fields per address, with every four addresses also grouped
+    into a MultiRegisterValue.
+    """
+    regs = []
+    for addr in range(naddresses):
+        regs.append(RegisterValue('lo{}'.format(addr), addr, 0, 4, writeable=True))
+        regs.append(RegisterValue('hi{}'.format(addr), addr, 4, 4, writeable=True))
+    regs.extend([MultiRegisterValue('multi{}'.format(addr), regs[2*addr:2*addr + 8])
+                 for addr in range(0, naddresses - 3, 4)])
+    return regs
+
+
+def make_states():
+    bme280 = load_bme280()
+
+    class BMESimulated(bme280.BME280BaseRegisterState, SimulatedRegisterState):
+        pass
+
+    states = {'bme280': BMESimulated(bus='i2c', latency=lambda nbytes: 0.)}
+    for n in (256, 4096):
+        states['synthetic{}'.format(n)] = SimulatedRegisterState(
+            synthetic_registers(n), naddresses=n, bus='spi',
+            latency=lambda nbytes: 0.)
+    return states
+
+
+def cases(state):
+    regs = [state.get_register(nm) for nm in state.register_names]
+    multis = list(state._name_to_multireg.values())
+    first = regs[0]
+    writeable = [r for r in regs if r.writeable]
+
+    toggle = [0]
+    def set_writeable():
+        # alternate the values so every write actually changes something
+        toggle[0] ^= 1
+        for r in writeable:
+            r.value = toggle[0]
+
+    def write_all(only_update):
+        set_writeable()
+        state.write_state(writeable, only_update=only_update)
+
+    def assemble_multis():
+        for mr in multis:
+            mr.value
+
+    yield 'read single field', lambda: state.read_state(first)
+    for groupread in (False, True, 'multi', 'auto'):
+        if groupread is True and state._max_block_size is not None:
+            # too many words for a single block on this bus
+            continue
+        yield ('read all groupread={!r}'.format(groupread),
+               lambda groupread=groupread: state.read_state(groupread=groupread))
+    yield 'write_state only_update=True', lambda: write_all(True)
+    yield 'write_state only_update=False', lambda: write_all(False)
+    yield 'flush', lambda: (set_writeable(), state.flush())
+
+    state.read_state()
+    yield 'MultiRegisterValue assembly', assemble_multis
+
+    # startup of another state with the same map
+    reglist = regs + multis
+    regmap = RegisterMap.from_registers(reglist, state.register_size)
+    naddresses = len(state.memory)
+    yield 'construct from registers', lambda: SimulatedRegisterState(
+        reglist, naddresses=naddresses, register_size=state.register_size)
+    yield 'construct from RegisterMap', lambda: SimulatedRegisterState(
+        regmap, naddresses=naddresses, register_size=state.register_size)
+
+
+def run_case(state, func, min_time):
+    func()  # warm up
+
+    # time enough repeats to get over min_time
+    nops = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        nops += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+
+    state.reset_counters()
+    tracemalloc.start()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time_per_op': elapsed / nops,
+            'alloc_peak_bytes': peak,
+            'transactions': state.transactions,
+            'nops': nops}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds to spend timing each case')
+    parser.add_argument('--json', help='file to write the results to')
+    parser.add_argument('-k', dest='select', default='',
+                        help='only run maps/cases containing this string')
+    args = parser.parse_args(argv)
+
+    results = []
+    for mapname, state in make_states().items():
+        for casename, func in cases(state):
+            if args.select not in '{} {}'.format(mapname, casename):
+                continue
+            res = run_case(state, func, args.min_time)
+            res['map'] = mapname
+            res['case'] = casename
+            results.append(res)
+            print('{:<14} {:<32} {:>12.2f} us {:>10} B {:>6} transactions'.format(
+                  mapname, casename, res['time_per_op']*1e6,
+                  res['alloc_peak_bytes'], res['transactions']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -2,14 +2,34 @@
 Example stateful register representation of a BME280 environment sensor
 """
 
-from stateful_registers import (RegisterValue, MultiRegisterValue,
-                                SPIRegisterState, I2CRegisterState)
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from stateful_registers import (RegisterValue, MultiRegisterValue, RegisterMap,
+                                SPIRegisterState, I2CRegisterState, run_on_bus)
+
+
+BME280Calibration = namedtuple('BME280Calibration',
+                               ['T1', 'T2', 'T3',
+                                'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7',
+                                'P8', 'P9',
+                                'H1', 'H2', 'H3', 'H4', 'H5', 'H6'])
 
 
 class BME280BaseRegisterState:
+    # the BME280 takes address/data pairs for multi-byte writes rather than
+    # auto-incrementing, so each word has to be its own write
+    block_writes = False
+
     def __init__(self, **kwargs):
-        kwargs.setdefault('registers', self.BME280_REGISTERS)
+        kwargs.setdefault('registers', self.BME280_MAP)
         self._rh_to_dewpoint = _rh_to_dewpoint_magnus
+        self._rh_to_dewpoint_array = _rh_to_dewpoint_magnus_array
+        self._calib = None
         super().__init__(**kwargs)
 
     BME280_REGISTERS = [
@@ -31,19 +51,26 @@ class BME280BaseRegisterState:
         RegisterValue('im_update', 0xF3, offset=3, nbits=1, writeable=False),
         RegisterValue('osrs_h', 0xF2, offset=0, nbits=3, writeable=True),
         RegisterValue('reset', 0xE0, offset=0, nbits=8, writeable=True),
-        RegisterValue('id', 0xD0, offset=0, nbits=8, writeable=False),
+        RegisterValue('id', 0xD0, offset=0, nbits=8, writeable=False,
+                      cache='constant'),
     ]
     BME280_REGISTERS += [
         MultiRegisterValue('hum', BME280_REGISTERS[:2]),
         MultiRegisterValue('temp', BME280_REGISTERS[2:5]),
         MultiRegisterValue('press', BME280_REGISTERS[5:8]),
     ]
+    # the calibration is factory-set, so it only needs to be read once
     BME280_REGISTERS += [RegisterValue('calib{:02}'.format(i), 0x88 + i,
-                                       nbits=8, writeable=False)
+                                       nbits=8, writeable=False,
+                                       cache='constant')
                          for i in range(26)]
     BME280_REGISTERS += [RegisterValue('calib{:02}'.format(i), 0xE1 + i - 26,
-                                       nbits=8, writeable=False)
+                                       nbits=8, writeable=False,
+                                       cache='constant')
                          for i in range(26, 42)]
+    # compiled once and shared, so each new device skips copying and
+    # validating the registers
+    BME280_MAP = RegisterMap.from_registers(BME280_REGISTERS)
 
     def read_env(self, tunit='F', punit='Pa', hunit='%'):
         """
@@ -58,7 +85,8 @@ class BME280BaseRegisterState:
                     self._name_to_multireg['hum'])
         self.read_state(env_regs, groupread=True)
 
-        self._update_calibs()
+        if self._calib is None:
+            self._update_calibs()
 
         # internal units are C, Pa, perc
         t, t_fine = self._compensate_temp(env_regs[0].value)
@@ -71,6 +99,67 @@ class BME280BaseRegisterState:
 
         return t, p, h
 
+    async def read_env_async(self, *args, **kwargs):
+        """
+        Like `read_env`, but runs on the bus executor without blocking the
+        event loop.
+        """
+        return await run_on_bus(self.bus_key, self.read_env, *args, **kwargs)
+
+    def compensate_arrays(self, adc_t, adc_p, adc_h, tunit='F', punit='Pa',
+                          hunit='%'):
+        """
+        Like `read_env`, but compensates arrays of raw ADC values (e.g. from
+        stored raw readings) instead of reading the device.  Uses this
+        device's calibration.  Requires numpy.
+        """
+        if np is None:
+            raise ImportError('numpy not present, cannot use compensate_arrays')
+
+        if self._calib is None:
+            self._update_calibs()
+
+        t, t_fine = self._compensate_temp_array(np.asarray(adc_t, dtype=float))
+        p = self._compensate_press_array(np.asarray(adc_p, dtype=float), t_fine)
+        h = self._compensate_hum_array(np.asarray(adc_h, dtype=float), t_fine)
+
+        if hunit == '%':
+            pass
+        elif hunit in ('C', 'F', 'K'):
+            h = self._convert_t(self._rh_to_dewpoint_array(h, t), hunit)
+        else:
+            raise NotImplementedError("Unrecognized humidity unit {}".format(hunit))
+        t = self._convert_t(t, tunit)
+        p = self._convert_p(p, punit)
+
+        return t, p, h
+
+    def reset(self):
+        """
+        Soft-resets the device, which also means the calibration will be
+        re-read on the next use.
+        """
+        self.set_and_write_register('reset', 0xB6, only_update=False)
+        self.invalidate_calibration()
+
+    def invalidate_calibration(self):
+        """
+        Drops the cached calibration, so that it is decoded again (from the
+        calibration registers) the next time it is needed.
+        """
+        self._calib = None
+
+    def read_calibration(self):
+        """
+        Re-reads the calibration registers from the device and returns the
+        decoded `BME280Calibration`.
+        """
+        cregs = [r for n, r in self._name_to_reg.items() if n.startswith('calib')]
+        self.read_state(cregs, groupread='auto', use_cache=False)
+        self.invalidate_calibration()
+        self._update_calibs()
+        return self._calib
+
     def _update_calibs(self):
         def calib_u16(calibnum0, swap=False, shift1=8):
             """
@@ -100,36 +189,24 @@ class BME280BaseRegisterState:
         cregs = [r for n, r in self._name_to_reg.items() if n.startswith('calib')]
         if any([r.value is None for r in cregs]):
             # something's not been read yet...
-            self.read_state(cregs)
-
-        self._calib = {}
-        self._calib['T1'] = calib_u16(0)
-        self._calib['T2'] = calib_s16(2)
-        self._calib['T3'] = calib_s16(4)
-
-        self._calib['P1'] = calib_u16(6)
-        self._calib['P2'] = calib_s16(8)
-        self._calib['P3'] = calib_s16(10)
-        self._calib['P4'] = calib_s16(12)
-        self._calib['P5'] = calib_s16(14)
-        self._calib['P6'] = calib_s16(16)
-        self._calib['P7'] = calib_s16(18)
-        self._calib['P8'] = calib_s16(20)
-        self._calib['P9'] = calib_s16(22)
-
-        self._calib['H1'] = calib_u8(25)
-        self._calib['H2'] = calib_s16(26)
-        self._calib['H3'] = calib_u8(28)
-        self._calib['H4'] = calib_s16(29, True, shift1=4)
-        self._calib['H5'] = calib_s16(30, shift1=4)
-        self._calib['H6'] = calib_s8(32)
+            self.read_state(cregs, groupread='auto')
+
+        self._calib = BME280Calibration(
+            T1=calib_u16(0), T2=calib_s16(2), T3=calib_s16(4),
+            P1=calib_u16(6), P2=calib_s16(8), P3=calib_s16(10),
+            P4=calib_s16(12), P5=calib_s16(14), P6=calib_s16(16),
+            P7=calib_s16(18), P8=calib_s16(20), P9=calib_s16(22),
+            H1=calib_u8(25), H2=calib_s16(26), H3=calib_u8(28),
+            H4=calib_s16(29, True, shift1=4), H5=calib_s16(30, shift1=4),
+            H6=calib_s8(32))
 
     def _compensate_temp(self, adc_t):
         """
         Returns t_true, t_fine where the former is in deg C and the latter is
         for _compensate_press
         """
-        dig_T1, dig_T2, dig_T3 = (self._calib['T'+str(i+1)] for i in range(3))
+        c = self._calib
+        dig_T1, dig_T2, dig_T3 = c.T1, c.T2, c.T3
 
         var1 = (adc_t/16384.0 - dig_T1/1024.) * dig_T2
         var2 = ((adc_t/131072.0 - dig_T1/8192.0) * (adc_t/131072.0 - dig_T1/8192.0)) * dig_T3
@@ -139,9 +216,10 @@ class BME280BaseRegisterState:
         return t_true, t_fine
 
     def _compensate_press(self, adc_p, t_fine):
-        dig_P1, dig_P2, dig_P3 = (self._calib['P'+str(i+1)] for i in range(3))
-        dig_P4, dig_P5, dig_P6 = (self._calib['P'+str(i+4)] for i in range(3))
-        dig_P7, dig_P8, dig_P9 = (self._calib['P'+str(i+7)] for i in range(3))
+        c = self._calib
+        dig_P1, dig_P2, dig_P3 = c.P1, c.P2, c.P3
+        dig_P4, dig_P5, dig_P6 = c.P4, c.P5, c.P6
+        dig_P7, dig_P8, dig_P9 = c.P7, c.P8, c.P9
 
         var1 = (t_fine/2.0) - 64000.0
         var2 = var1 * var1 * dig_P6 / 32768.0
@@ -159,8 +237,9 @@ class BME280BaseRegisterState:
         return p + (var1 + var2 + dig_P7) / 16.0
 
     def _compensate_hum(self, adc_h, t_fine):
-        dig_H1, dig_H2, dig_H3 = (self._calib['H'+str(i+1)] for i in range(3))
-        dig_H4, dig_H5, dig_H6 = (self._calib['H'+str(i+4)] for i in range(3))
+        c = self._calib
+        dig_H1, dig_H2, dig_H3 = c.H1, c.H2, c.H3
+        dig_H4, dig_H5, dig_H6 = c.H4, c.H5, c.H6
 
         var_H = t_fine - 76800.0
         var_H = ((adc_h - (dig_H4 * 64.0 + dig_H5 / 16384.0 * var_H)) *
@@ -175,6 +254,61 @@ class BME280BaseRegisterState:
         else:
             return var_H
 
+    def _compensate_temp_array(self, adc_t):
+        """
+        Array version of `_compensate_temp`
+        """
+        c = self._calib
+        dig_T1, dig_T2, dig_T3 = c.T1, c.T2, c.T3
+
+        var1 = (adc_t/16384.0 - dig_T1/1024.) * dig_T2
+        var2 = (adc_t/131072.0 - dig_T1/8192.0)**2 * dig_T3
+
+        t_fine = var1 + var2
+        return t_fine / 5120.0, t_fine
+
+    def _compensate_press_array(self, adc_p, t_fine):
+        """
+        Array version of `_compensate_press`
+        """
+        c = self._calib
+        dig_P1, dig_P2, dig_P3 = c.P1, c.P2, c.P3
+        dig_P4, dig_P5, dig_P6 = c.P4, c.P5, c.P6
+        dig_P7, dig_P8, dig_P9 = c.P7, c.P8, c.P9
+
+        var1 = (t_fine/2.0) - 64000.0
+        var2 = var1 * var1 * dig_P6 / 32768.0
+        var2 = var2 + var1 * dig_P5 * 2.0
+        var2 = (var2/4.0)+(dig_P4 * 65536.0)
+        var1 = (dig_P3 * var1 * var1 / 524288.0 + dig_P2 * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0)*dig_P1
+        # avoid division by zero, and report those as 0 like the scalar version
+        zero = var1 == 0.0
+        var1 = np.where(zero, 1.0, var1)
+
+        p = 1048576.0 - adc_p
+        p = (p - (var2 / 4096.0)) * 6250.0 / var1
+        var1 = dig_P9 * p * p / 2147483648.0
+        var2 = p * dig_P8 / 32768.0
+        p = p + (var1 + var2 + dig_P7) / 16.0
+        return np.where(zero, 0.0, p)
+
+    def _compensate_hum_array(self, adc_h, t_fine):
+        """
+        Array version of `_compensate_hum`
+        """
+        c = self._calib
+        dig_H1, dig_H2, dig_H3 = c.H1, c.H2, c.H3
+        dig_H4, dig_H5, dig_H6 = c.H4, c.H5, c.H6
+
+        var_H = t_fine - 76800.0
+        var_H = ((adc_h - (dig_H4 * 64.0 + dig_H5 / 16384.0 * var_H)) *
+                 (dig_H2 / 65536.0 * (1.0 + dig_H6 / 67108864.0 * var_H *
+                 (1.0 + dig_H3 / 67108864.0 * var_H))))
+        var_H = var_H * (1.0 - dig_H1 * var_H / 524288.0)
+
+        return np.clip(var_H, 0.0, 100.0)
+
     def _convert_t(self, t, tunit):
         if tunit == 'C':
             return t
@@ -216,6 +350,13 @@ def _rh_to_dewpoint_magnus(rh, tc, b=18.678, c=257.14):
     gam = ln(rh/100.) + b*tc / (c + tc)
     return c*gam / (b - gam)
 
+def _rh_to_dewpoint_magnus_array(rh, tc, b=18.678, c=257.14):
+    """
+    Array version of `_rh_to_dewpoint_magnus`
+    """
+    gam = np.log(np.asarray(rh)/100.) + b*tc / (c + tc)
+    return c*gam / (b - gam)
+
 def _rh_to_dewpoint_ardenbuck(rh, tc, b=18.678, c=257.14, d=234.5):
     """
     See https://en.wikipedia.org/wiki/Dew_point#Calculating_the_dew_point
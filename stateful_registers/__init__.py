@@ -2,3 +2,13 @@ from .register_state import *
 from .spi import *
 from .i2c import *
 from .file import *
+from .arrays import *
+from .simulated import *
+from .instrumentation import *
+from .aio import *
+from .bus import *
+from .stream import *
+from .fleet import *
+from .recorder import *
+from .replay import *
+from .regmap import *
@@ -0,0 +1,66 @@
+"""
+Support for running `RegisterState` operations from asyncio without blocking
+the event loop.
+
+Each bus gets its own single-threaded executor, so a slow device only holds up
+the other devices on the same bus, and transactions to a given bus always run
+in the order they were submitted.
+"""
+import asyncio
+import functools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['get_bus_executor', 'release_bus_executor',
+           'shutdown_bus_executors', 'run_on_bus']
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_bus_executor(bus_key):
+    """
+    Returns the single-threaded executor used for the bus identified by
+    ``bus_key`` (see `RegisterState.bus_key`), creating it if needed.
+    """
+    with _executors_lock:
+        executor = _executors.get(bus_key)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=1,
+                                          thread_name_prefix='bus-{}'.format(bus_key))
+            _executors[bus_key] = executor
+        return executor
+
+
+def release_bus_executor(bus_key, wait=False):
+    """
+    Shuts down the executor for ``bus_key``, if there is one.  A new one will
+    be created if it is needed again.
+    """
+    with _executors_lock:
+        executor = _executors.pop(bus_key, None)
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def shutdown_bus_executors(wait=True):
+    """
+    Shuts down all the bus executors.  New ones will be created if needed.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+def run_on_bus(bus_key, func, *args, **kwargs):
+    """
+    Runs ``func(*args, **kwargs)`` on the executor for ``bus_key`` and returns
+    an awaitable of the result, e.g. for the ``*_async`` methods of a
+    `RegisterState` subclass.  Must be called from a running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_bus_executor(bus_key),
+                                functools.partial(func, *args, **kwargs))
@@ -0,0 +1,117 @@
+"""
+Vectorized decoding of many raw register snapshots at once, using numpy.
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .register_state import RegisterValue, MultiRegisterValue
+
+__all__ = ['decode_snapshots']
+
+
+def _uint_dtype(nbits):
+    for dt in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if nbits <= np.iinfo(dt).bits:
+            return dt
+    raise ValueError('Cannot decode values wider than 64 bits into an array, '
+                     'asked for {}'.format(nbits))
+
+
+def decode_snapshots(state, raw, addresses=None, registers=None):
+    """
+    Decodes a set of raw register snapshots into a structured array, using the
+    same masks and offsets as `RegisterState.read_state`.
+
+    Parameters
+    ----------
+    state : RegisterState
+        The state providing the register map.
+    raw : array-like
+        An (N_samples x N_addresses) integer array of raw words, one row per
+        snapshot.
+    addresses : int, sequence of int, or None
+        The address of each column of ``raw``.  An int means the columns are
+        a contiguous burst starting at that address, None means the columns
+        are all of ``state``'s addresses in sorted order.
+    registers : sequence or None
+        The `RegisterValue`/`MultiRegisterValue` objects (or names) to
+        decode.  If None, decode everything covered by ``addresses``.
+
+    Returns
+    -------
+    decoded : numpy structured array
+        Length N_samples, with one field per register name.
+    """
+    if np is None:
+        raise ImportError('numpy not present, cannot use decode_snapshots')
+
+    raw = np.asarray(raw)
+    if raw.ndim != 2:
+        raise ValueError('raw must be a 2D (samples x addresses) array')
+
+    if addresses is None:
+        addresses = list(state._decode_addrs)
+    elif isinstance(addresses, int):
+        addresses = range(addresses, addresses + raw.shape[1])
+    if len(addresses) != raw.shape[1]:
+        raise ValueError('raw has {} columns but {} addresses were '
+                         'given'.format(raw.shape[1], len(addresses)))
+    addr_to_col = {addr: i for i, addr in enumerate(addresses)}
+
+    if registers is None:
+        regs = [r for r in state._field_regs if r.address in addr_to_col]
+        regs.extend(mr for mr in state._name_to_multireg.values()
+                    if all(r.address in addr_to_col for r in mr.registers))
+    else:
+        regs = [state.get_register(r) if isinstance(r, str) else r
+                for r in registers]
+        for reg in regs:
+            subregs = reg.registers if isinstance(reg, MultiRegisterValue) else (reg,)
+            for r in subregs:
+                if r.address not in addr_to_col:
+                    raise ValueError('Register {} at address {} is not in the '
+                                     'snapshots'.format(r.name, r.address))
+
+    # decode each field once, even if it is also part of a multi-register
+    field_cache = {}
+    def field_values(regv):
+        if regv.name not in field_cache:
+            col = raw[:, addr_to_col[regv.address]]
+            vals = (col & regv.bitmask) >> regv.offset
+            field_cache[regv.name] = vals.astype(_uint_dtype(regv.nbits))
+        return field_cache[regv.name]
+
+    dtypes = []
+    columns = []
+    for reg in regs:
+        if isinstance(reg, MultiRegisterValue):
+            dt = _uint_dtype(sum(r.nbits for r in reg.registers))
+            vals = np.zeros(raw.shape[0], dtype=dt)
+            for r, shift in zip(reg.registers, reg._shifts):
+                vals |= field_values(r).astype(dt) << dt(shift)
+        elif isinstance(reg, RegisterValue):
+            vals = field_values(reg)
+        else:
+            raise TypeError('registers must be RegisterValues, '
+                            'MultiRegisterValues, or names')
+        dtypes.append((reg.name, vals.dtype))
+        columns.append(vals)
+
+    decoded = np.empty(raw.shape[0], dtype=dtypes)
+    for (name, _), vals in zip(dtypes, columns):
+        decoded[name] = vals
+    return decoded
+
+
+def _with_time(timestamps, decoded):
+    """
+    Returns the output of `decode_snapshots` with a ``'time'`` field of
+    ``timestamps`` added before the decoded fields.
+    """
+    out = np.empty(len(decoded), dtype=[('time', 'f8')] + decoded.dtype.descr)
+    out['time'] = timestamps
+    for name in decoded.dtype.names:
+        out[name] = decoded[name]
+    return out
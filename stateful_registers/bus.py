@@ -0,0 +1,168 @@
+"""
+Sharing bus handles between several `RegisterState` instances on the same bus.
+
+Each bus gets one handle (e.g. an ``smbus.SMBus``) and one `FairLock`, which
+the backends hold for each transaction.  `BusManager.batch` holds the lock for
+a whole group of transactions (e.g. a `RegisterState.read_state`), and since
+the lock is first-come-first-served, threads polling different devices on the
+same bus get their turns in order.
+"""
+import threading
+
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+__all__ = ['BusManager', 'FairLock', 'default_bus_manager']
+
+
+class FairLock:
+    """
+    A re-entrant lock that is granted to waiting threads in the order they
+    asked for it.
+    """
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._count = 0
+        self._waiters = deque()
+
+    def acquire(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._count += 1
+                return True
+
+            self._waiters.append(me)
+            while self._owner is not None or self._waiters[0] != me:
+                self._cond.wait()
+            self._waiters.popleft()
+            self._owner = me
+            self._count = 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._owner != threading.get_ident():
+                raise RuntimeError('cannot release a FairLock held by another thread')
+            self._count -= 1
+            if self._count == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class BusManager:
+    """
+    Pools one handle and one `FairLock` per bus.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._refcounts = defaultdict(int)
+        self._bus_locks = defaultdict(FairLock)
+
+    def _get(self, key, opener):
+        with self._lock:
+            if key not in self._handles:
+                self._handles[key] = opener()
+            self._refcounts[key] += 1
+            return self._handles[key]
+
+    def get_i2c(self, i2c_bus):
+        """
+        Returns the shared ``smbus.SMBus`` for ``i2c_bus`` and its lock.
+        """
+        from .i2c import smbus
+
+        handle = self._get(('i2c', i2c_bus), lambda: smbus.SMBus(i2c_bus))
+        return handle, self.lock(('i2c', i2c_bus))
+
+    def get_spi(self, spi_bus, spi_device):
+        """
+        Returns the shared ``spidev.SpiDev`` for ``spi_device`` on ``spi_bus``
+        and the lock for the bus.
+        """
+        from .spi import spidev
+
+        def opener():
+            spi = spidev.SpiDev()
+            spi.open(spi_bus, spi_device)
+            return spi
+
+        handle = self._get(('spi', spi_bus, spi_device), opener)
+        return handle, self.lock(('spi', spi_bus))
+
+    def release(self, key):
+        """
+        Drops one reference to the handle for ``key``, closing it if it was
+        the last.
+        """
+        with self._lock:
+            self._refcounts[key] -= 1
+            if self._refcounts[key] <= 0:
+                del self._refcounts[key]
+                handle = self._handles.pop(key, None)
+                if handle is not None and hasattr(handle, 'close'):
+                    handle.close()
+
+    def lock(self, bus_key):
+        """
+        Returns the `FairLock` for the bus identified by ``bus_key`` (see
+        `RegisterState.bus_key`).
+        """
+        with self._lock:
+            return self._bus_locks[bus_key]
+
+    @contextmanager
+    def batch(self, state):
+        """
+        Holds ``state``'s bus for all the transactions in the ``with`` block.
+        """
+        with self.lock(state.bus_key):
+            yield state
+
+    def poll(self, states, func, *args, executor=None, **kwargs):
+        """
+        Calls ``func(state, *args, **kwargs)`` for each of ``states`` while
+        holding its bus, and returns the results in the same order.
+
+        If ``executor`` (a `concurrent.futures.Executor`) is given the calls are
+        submitted to it, alternating between buses so the workers spread out
+        over them, and the bus locks give the devices on each bus their turns
+        in order.  Otherwise the calls are made here in the same order.
+        """
+        by_bus = defaultdict(deque)
+        for i, state in enumerate(states):
+            by_bus[state.bus_key].append((i, state))
+
+        def call(state):
+            with self.batch(state):
+                return func(state, *args, **kwargs)
+
+        order = []
+        while by_bus:
+            for key in list(by_bus):
+                order.append(by_bus[key].popleft())
+                if not by_bus[key]:
+                    del by_bus[key]
+
+        results = [None]*len(states)
+        if executor is None:
+            for i, state in order:
+                results[i] = call(state)
+        else:
+            futures = [(i, executor.submit(call, state)) for i, state in order]
+            for i, future in futures:
+                results[i] = future.result()
+        return results
+
+
+#: The manager used by the SPI and I2C backends unless given another.
+default_bus_manager = BusManager()
@@ -1,11 +1,51 @@
+import mmap
+import os
+import sys
+import threading
+
+from functools import partial
+
 try:
     import smbus
 except ImportError:
     smbus = None
 
-from .register_state import RegisterState
+from .register_state import RegisterState, _read_words_into
+
+__all__ = ['FileRegisterState', 'ImageFileRegisterState']
+
+
+def _read_text(fn, hex=True):
+    """
+    Reads a text register file of "address value" rows into a dictionary.
+    """
+    base = 16 if hex else 10
+
+    data = {}
+    with open(fn, 'r') as f:
+        for l in f:
+            if l.strip() == '':
+                continue
+
+            ls = l.split()
+            assert len(ls) == 2, 'Input file has row {} which is not two-element'.format(l)
+            addr, val = ls
 
-__all__ = ['FileRegisterState']
+            data[int(addr, base=base)] = int(val, base=base)
+    return data
+
+
+def _write_text(fn, data, hex=True):
+    """
+    Writes a dictionary of address: value as a text register file.
+    """
+    if hex:
+        msg = '{:x} {:x}\n'
+    else:
+        msg = '{} {}\n'
+    with open(fn, 'w') as f:
+        for addr in sorted(data):
+            f.write(msg.format(addr, data[addr]))
 
 
 class FileRegisterState(RegisterState):
@@ -19,60 +59,348 @@ class FileRegisterState(RegisterState):
     outfn : str
         Writeable file to use as the output, if None, means use the same as ``infn``.
     update : bool
-        If True, read/write the file whenever the register is accessed, if
-        False waits for an explicit `read_file` `write_file` call.
+        If True, re-read the file when a register is accessed if it has
+        changed (by inode, modification time, or size) since it was last
+        read.  If False waits for an explicit `read_file` `write_file` call.
     hex : bool
         If True, the file is in hex, if False, assume decimal
+    journal : bool
+        If True, writes are persisted by appending just the changed
+        "address value" rows to the output file (later rows win when it is
+        read), according to ``flush_every`` and ``flush_interval``, instead of
+        waiting for `write_file` to rewrite everything.
+    flush_every : int or None
+        In journal mode, append the pending writes after this many writes.
+    flush_interval : float or None
+        In journal mode, append the pending writes at most this many seconds
+        after they were made.
+    compact_after : int
+        In journal mode, rewrite the output file without superseded rows (in a
+        background thread) once this many rows have been appended.
     """
     def __init__(self, registers, infn, outfn=None, update=False, hex=True,
-                 register_size=8):
-        super().__init__(registers, register_size)
+                 register_size=8, threadsafe=False, journal=False,
+                 flush_every=None, flush_interval=None, compact_after=1000):
+        super().__init__(registers, register_size, threadsafe)
         self.infn = infn
+        self._bus_key = ('file', os.path.abspath(infn))
         self.outfn = outfn
         self.update = update
         self.hex = True
         self._file_data = None
+        self._file_sig = None
+        # contiguous copy of _file_data for burst reads, built when needed
+        self._file_array = None
+        self._file_base = 0
 
-    def read_file(self):
-        base = 16 if self.hex else 10
+        self.journal = journal
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self._pending = {}
+        self._writes_since_flush = 0
+        self._journal_lock = threading.RLock()
+        self._journal_rows = None  # None until the output has been written once
+        self._flush_timer = None
+        self._compactor = None
+        self._compact_backlog = None
 
-        self._file_data = {}
-        with open(self.infn, 'r') as f:
-            for l in f:
-                if l.strip() == '':
-                    continue
+    @property
+    def _outfn(self):
+        return self.infn if self.outfn is None else self.outfn
 
-                ls = l.split()
-                assert len(ls) == 2, 'Input file has row {} which is not two-element'.format(l)
-                addr, val = ls
+    def _signature(self, fn):
+        st = os.stat(fn)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
 
-                self._file_data[int(addr, base=base)] = int(val, base=base)
+    def read_file(self):
+        self._file_sig = self._signature(self.infn)
+        data = _read_text(self.infn, self.hex)
+        with self._journal_lock:
+            # don't lose writes that haven't made it to the file yet
+            data.update(self._pending)
+            self._file_data = data
+            self._file_array = None
+
+    def _wrote_output(self):
+        # our own writes to the input file don't need it to be re-read
+        if self._outfn == self.infn and self._file_sig is not None:
+            self._file_sig = self._signature(self.infn)
+
+    def _data_array(self):
+        """
+        Returns the file data as a list covering the lowest to highest
+        address (with None for missing addresses), and the lowest address.
+        """
+        if self._file_array is None:
+            data = self._file_data
+            if data:
+                self._file_base = base = min(data)
+                arr = [None]*(max(data) - base + 1)
+                for addr, val in data.items():
+                    arr[addr - base] = val
+            else:
+                arr = []
+            self._file_array = arr
+        return self._file_array, self._file_base
 
     def write_file(self):
         if self._file_data is None:
             return
 
-        if self.outfn is None:
-            outfn = self.infn
-        else:
-            outfn = self.outfn
+        with self._journal_lock:
+            self._wait_for_compaction()
+            _write_text(self._outfn, self._file_data, self.hex)
+            self._wrote_output()
+            self._pending.clear()
+            self._writes_since_flush = 0
+            self._journal_rows = len(self._file_data)
+
+    def write_journal(self):
+        """
+        Appends the writes made since the last flush to the output file.  The
+        first time, the whole file is written instead.
+        """
+        with self._journal_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._pending:
+                return
+            if self._journal_rows is None:
+                self.write_file()
+                return
+
+            pending = self._pending
+            self._pending = {}
+            self._writes_since_flush = 0
+            msg = '{:x} {:x}\n' if self.hex else '{} {}\n'
+            with open(self._outfn, 'a') as f:
+                for addr, val in pending.items():
+                    f.write(msg.format(addr, val))
+            self._wrote_output()
+            self._journal_rows += len(pending)
+            if self._compact_backlog is not None:
+                self._compact_backlog.update(pending)
+
+            if (self._journal_rows > max(self.compact_after, 2*len(self._file_data))
+                    and self._compactor is None):
+                self._start_compaction()
 
-        with open(outfn, 'w') as f:
-            for addr in sorted(self._file_data):
-                if self.hex:
-                    msg = '{:x} {:x}\n'
-                else:
-                    msg = '{} {}\n'
-                f.write(msg.format(addr, self._file_data[addr]))
+    def close(self):
+        """
+        Writes any pending journal rows and waits for compaction to finish.
+        """
+        if self.journal:
+            self.write_journal()
+        with self._journal_lock:
+            self._wait_for_compaction()
+        super().close()
+
+    def _start_compaction(self):
+        # snapshot now, and collect what gets appended while rewriting
+        snapshot = dict(self._file_data)
+        self._compact_backlog = {}
+        self._compactor = threading.Thread(target=self._compact,
+                                           args=(snapshot,), daemon=True,
+                                           name='FileRegisterState-compact')
+        self._compactor.start()
+
+    def _compact(self, snapshot):
+        outfn = self._outfn
+        tmpfn = '{}.compact-{}'.format(outfn, os.getpid())
+        _write_text(tmpfn, snapshot, self.hex)
+
+        with self._journal_lock:
+            backlog = self._compact_backlog
+            if backlog:
+                msg = '{:x} {:x}\n' if self.hex else '{} {}\n'
+                with open(tmpfn, 'a') as f:
+                    for addr, val in backlog.items():
+                        f.write(msg.format(addr, val))
+            os.replace(tmpfn, outfn)
+            self._wrote_output()
+            self._journal_rows = len(snapshot) + len(backlog)
+            self._compact_backlog = None
+            self._compactor = None
+
+    def _wait_for_compaction(self):
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            # the compactor needs the lock to finish
+            self._journal_lock.release()
+            try:
+                compactor.join()
+            finally:
+                self._journal_lock.acquire()
 
     def _read_register(self, address, ntimes=None):
-        if self.update or self._file_data is None:
+        if self._file_data is None:
+            self.read_file()
+        elif self.update and self._signature(self.infn) != self._file_sig:
             self.read_file()
 
         if ntimes is None:
             return self._file_data[address]
+
+        arr, base = self._data_array()
+        vals = arr[address - base:address - base + ntimes]
+        if address < base or len(vals) < ntimes or None in vals:
+            missing = [address + i for i in range(ntimes)
+                       if address + i not in self._file_data]
+            raise KeyError(missing[0])
+        return vals
+
+    def _write_register(self, address, value):
+        if self._file_data is None:
+            self.read_file()
+
+        values = [value] if isinstance(value, int) else value
+        if not self.journal:
+            self._store(address, values)
+            return
+
+        # the flush timer's thread reads _file_data, so change it under the
+        # lock
+        with self._journal_lock:
+            self._store(address, values)
+            for i, v in enumerate(values):
+                self._pending[address + i] = v
+            self._writes_since_flush += 1
+            if (self.flush_every is not None and
+                    self._writes_since_flush >= self.flush_every):
+                self.write_journal()
+            elif self.flush_interval is not None and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval,
+                                                    self.write_journal)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _store(self, address, values):
+        data = self._file_data
+        arr = self._file_array
+        if arr is None:
+            # the next burst read builds it, if there is one
+            for i, v in enumerate(values):
+                data[address + i] = v
+            return
+
+        base = self._file_base
+        for i, v in enumerate(values):
+            addr = address + i
+            data[addr] = v
+            if base <= addr < base + len(arr):
+                arr[addr - base] = v
+            else:
+                self._file_array = None
+
+
+class ImageFileRegisterState(RegisterState):
+    """
+    A `RegisterState` stored as a binary image of the register words in a
+    memory-mapped file.  The word at an address is always at the same offset
+    in the file, so reads and writes go straight to the file without any
+    parsing or rewriting, and several processes can share the same file.
+
+    Parameters
+    ----------
+    fn : str
+        The image file.  Created (filled with zeros) if it does not exist, and
+        extended if it is shorter than ``naddresses`` words.
+    naddresses : int
+        The number of addresses in the image.
+    byteorder : 'little' or 'big'
+        The byte order of words wider than 8 bits.
+    """
+    def __init__(self, registers, fn, naddresses=256, register_size=8,
+                 byteorder='little', threadsafe=False):
+        super().__init__(registers, register_size, threadsafe, byteorder)
+        self.fn = fn
+        self._bus_key = ('file', os.path.abspath(fn))
+        self.naddresses = naddresses
+
+        size = naddresses*self._word_bytes
+        mode = 'r+b' if os.path.exists(fn) else 'w+b'
+        self._file = open(fn, mode)
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+    def close(self):
+        """
+        Flushes and closes the image file.
+        """
+        if self._mmap is not None:
+            self._mmap.flush()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+        super().close()
+
+    def sync(self):
+        """
+        Flushes the image to disk.  Other processes mapping the same file see
+        changes immediately either way.
+        """
+        self._mmap.flush()
+
+    def import_text(self, fn, hex=True):
+        """
+        Loads the contents of a text register file (as used by
+        `FileRegisterState`) into the image.
+        """
+        for addr, val in _read_text(fn, hex).items():
+            self._write_register(addr, val)
+
+    def export_text(self, fn, hex=True):
+        """
+        Writes every address of the image as a text register file (as used by
+        `FileRegisterState`).
+        """
+        _write_text(fn, dict(enumerate(self._read_register(0, self.naddresses))),
+                    hex)
+
+    def _read_register(self, address, ntimes=None):
+        n = 1 if ntimes is None else ntimes
+        if address < 0 or address + n > self.naddresses:
+            raise ValueError('Address range {}-{} is outside the '
+                             'image'.format(address, address + n - 1))
+
+        wb = self._word_bytes
+        if wb == 1:
+            if ntimes is None:
+                return self._mmap[address]
+            else:
+                return list(self._mmap[address:address + n])
+
+        vals = self._unpack_words(self._mmap[address*wb:(address + n)*wb])
+        return vals[0] if ntimes is None else vals
+
+    def _read_into(self, address, buf):
+        n = len(buf)
+        wb = self._word_bytes
+        if wb == 1:
+            if address < 0 or address + n > self.naddresses:
+                raise ValueError('Address range {}-{} is outside the '
+                                 'image'.format(address, address + n - 1))
+            buf[:] = memoryview(self._mmap)[address:address + n]
+        elif wb in (2, 4, 8) and self.byteorder == sys.byteorder:
+            # the image is laid out just like the buffer, so copy the bytes
+            if address < 0 or address + n > self.naddresses:
+                raise ValueError('Address range {}-{} is outside the '
+                                 'image'.format(address, address + n - 1))
+            buf.cast('B')[:] = memoryview(self._mmap)[address*wb:(address + n)*wb]
         else:
-            return [self._file_data[address+i] for i in range(ntimes)]
+            # not through self._read_register, which is recorded separately
+            # when instrumented
+            _read_words_into(partial(type(self)._read_register, self), address,
+                             buf)
 
     def _write_register(self, address, value):
-        self._file_data[address] = value
+        values = [value] if isinstance(value, int) else value
+        if address < 0 or address + len(values) > self.naddresses:
+            raise ValueError('Address range {}-{} is outside the '
+                             'image'.format(address, address + len(values) - 1))
+
+        wb = self._word_bytes
+        self._mmap[address*wb:(address + len(values))*wb] = self._pack_words(values)
@@ -0,0 +1,414 @@
+"""
+Polling many devices from a pool of worker processes, one per bus.
+
+Decoding and bookkeeping for hundreds of devices is enough to keep one Python
+process busy, so `FleetPoller` gives each bus its own process.  The workers
+construct their `RegisterState`'s from picklable `DeviceSpec` descriptions,
+read them with preallocated `BurstBuffer`'s, and write the raw words into a
+ring buffer in shared memory, so nothing but the occasional error message
+has to be pickled and sent back to the parent.
+"""
+import multiprocessing
+import time
+import traceback
+
+from array import array
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+from .register_state import MultiRegisterValue, _word_typecode
+from .simulated import SimulatedRegisterState
+from .timing import _Pacer
+
+__all__ = ['FleetPoller', 'DeviceSpec']
+
+
+#: A description of a device, from which a worker process constructs its
+#: `RegisterState` as ``cls(*args, **kwargs)``.  ``cls`` must be importable
+#: (so it can be pickled), and ``args``/``kwargs`` include the register map for
+#: the generic backends.  ``bus`` is a hashable naming the bus the device is
+#: on, and devices with the same ``bus`` are polled by the same worker.  If
+#: None, it is taken from an ``i2c_bus`` or ``spi_bus`` keyword argument, or
+#: the device gets a worker of its own.  ``registers`` is the registers (or
+#: names) to poll, or None for all of them.
+DeviceSpec = namedtuple('DeviceSpec', ['cls', 'args', 'kwargs', 'bus',
+                                       'registers'],
+                        defaults=((), None, None, None))
+
+
+def _bus_of(spec, index):
+    if spec.bus is not None:
+        return spec.bus
+    kwargs = spec.kwargs or {}
+    if 'i2c_bus' in kwargs:
+        return ('i2c', kwargs['i2c_bus'])
+    if 'spi_bus' in kwargs:
+        return ('spi', kwargs['spi_bus'])
+    return ('device', index)
+
+
+def _detached_registers(state):
+    """
+    Copies of the registers of ``state`` that are not attached to it, for
+    sending to another process.
+    """
+    regs = {}
+    for name, reg in state._name_to_reg.items():
+        reg = reg.copy()
+        reg._state = None
+        regs[name] = reg
+    multis = [MultiRegisterValue(mr.name, [regs[r.name] for r in mr.registers],
+                                 mr.description)
+              for mr in state._name_to_multireg.values()]
+    return list(regs.values()) + multis
+
+
+def _layout(sizes, capacity):
+    """
+    Works out where each device's timestamps and words go in a worker's
+    shared memory, from the ``(nwords, itemsize)`` of each device.  The first
+    16 bytes hold the number of cycles the worker has started and finished.
+    """
+    offsets = []
+    offset = 16
+    for nwords, itemsize in sizes:
+        ts_offset = offset
+        offset += 8*capacity
+        offsets.append((ts_offset, offset))
+        # keep each device's words 8-byte aligned
+        offset += -(-nwords*itemsize*capacity // 8)*8
+    return offsets, offset
+
+
+def _poll_worker(specs, groupread, rate, capacity, conn, cond):
+    try:
+        states = [spec.cls(*spec.args, **(spec.kwargs or {})) for spec in specs]
+        buffers = []
+        for spec, state in zip(specs, states):
+            registers = spec.registers
+            if registers is not None:
+                registers = [state.get_register(r) if isinstance(r, str) else r
+                             for r in registers]
+            buffers.append(state.burst_buffer(registers, groupread))
+
+        conn.send(('ready', [(_detached_registers(state), state.register_size,
+                              buf.addresses)
+                             for state, buf in zip(states, buffers)]))
+    except Exception:
+        conn.send(('failed', traceback.format_exc()))
+        return
+
+    try:
+        name = conn.recv()
+        if name is not None:
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                _poll_loop(shm.buf, buffers, rate, capacity, conn, cond)
+            finally:
+                shm.close()
+    finally:
+        for state in states:
+            if hasattr(state, 'close'):
+                state.close()
+
+
+def _poll_loop(view, buffers, rate, capacity, conn, cond):
+    views = [view[:16].cast('q')]
+    counts = views[0]
+    offsets, _ = _layout([(len(buf), buf.buffer.itemsize) for buf in buffers],
+                         capacity)
+    slots = []
+    for (ts_offset, words_offset), buf in zip(offsets, buffers):
+        nbytes = len(buf)*buf.buffer.itemsize
+        views.append(view[ts_offset:ts_offset + 8*capacity].cast('d'))
+        views.append(view[words_offset:words_offset + nbytes*capacity])
+        slots.append((buf, views[-2], views[-1], memoryview(buf.buffer).cast('B'),
+                      nbytes))
+        views.append(slots[-1][3])
+
+    try:
+        pacer = _Pacer(rate, time.monotonic)
+        cycle = 0
+        while not conn.poll():
+            slot = cycle % capacity
+            with cond:
+                counts[0] = cycle + 1
+            for i, (buf, timestamps, words, buf_bytes, nbytes) in enumerate(slots):
+                timestamps[slot] = time.time()
+                try:
+                    buf.read()
+                except Exception as e:
+                    # mark the sample as missing and carry on with the others
+                    timestamps[slot] = float('nan')
+                    conn.send(('error', i, repr(e)))
+                    continue
+                words[slot*nbytes:(slot + 1)*nbytes] = buf_bytes
+            cycle += 1
+            with cond:
+                counts[1] = cycle
+                cond.notify_all()
+
+            pacer.wait()
+    finally:
+        # the shared memory can't be closed while there are views of it
+        del slots
+        for v in reversed(views):
+            v.release()
+
+
+class _Worker:
+    def __init__(self, process, conn, indices):
+        self.process = process
+        self.conn = conn
+        self.indices = indices
+        self.shm = None
+        self.offsets = None
+        self.consumed = 0
+
+
+class FleetPoller:
+    """
+    Polls a fleet of devices from worker processes, one per bus.
+
+    Each worker reads all of its devices once per cycle (at ``rate`` cycles
+    per second), each into its own ring buffer of ``capacity`` samples in
+    shared memory.  `collect` copies out the samples that have arrived since
+    it was last called, and `decode`/`latest` turn them into values in the
+    parent, using copies of the workers' register maps.
+
+    Parameters
+    ----------
+    devices : sequence of DeviceSpec
+        The devices to poll.
+    rate : float
+        Target polling cycles per second for each bus.
+    capacity : int
+        Number of samples kept for each device.  If `collect` is not called
+        often enough, the oldest samples are dropped (see `overruns`).
+    groupread : bool or 'auto'
+        How to group each device's addresses into bursts, as in
+        `RegisterState.burst_buffer`.
+    context : multiprocessing context or None
+        Used to start the workers, if None the default context.
+
+    Examples
+    --------
+    ::
+
+        specs = [DeviceSpec(BME280I2C, kwargs=dict(i2c_bus=bus, device_address=a))
+                 for bus in (1, 3) for a in (0x76, 0x77)]
+        with FleetPoller(specs, rate=20) as fleet:
+            while True:
+                for i, (timestamps, raw) in fleet.collect(timeout=1).items():
+                    store(i, timestamps, fleet.decode(i, raw))
+    """
+    def __init__(self, devices, rate=10., capacity=256, groupread='auto',
+                 context=None):
+        self.devices = [DeviceSpec(*d) if not isinstance(d, DeviceSpec) else d
+                        for d in devices]
+        self.rate = rate
+        self.capacity = capacity
+        self.groupread = groupread
+        self._context = multiprocessing.get_context() if context is None else context
+
+        self.buses = {}
+        for i, spec in enumerate(self.devices):
+            self.buses.setdefault(_bus_of(spec, i), []).append(i)
+
+        n = len(self.devices)
+        self.addresses = [None]*n
+        self.mirrors = [None]*n
+        self.overruns = [0]*n
+        self.errors = {}
+        self._typecodes = [None]*n
+        self._workers = []
+        # guards the cycle counts in shared memory, and signals new cycles
+        self._cond = self._context.Condition()
+
+    def start(self):
+        """
+        Starts a worker process for each bus, and waits for them to construct
+        their devices.
+        """
+        if self._workers:
+            return
+
+        # the workers need to share our resource tracker, or theirs would
+        # unlink the shared memory when they exit
+        resource_tracker.ensure_running()
+
+        try:
+            for bus, indices in self.buses.items():
+                specs = [self.devices[i] for i in indices]
+                parent_conn, child_conn = self._context.Pipe()
+                process = self._context.Process(
+                    target=_poll_worker, name='FleetPoller-{}'.format(bus),
+                    args=(specs, self.groupread, self.rate, self.capacity,
+                          child_conn, self._cond),
+                    daemon=True)
+                process.start()
+                child_conn.close()
+                self._workers.append(_Worker(process, parent_conn, indices))
+
+            for worker in self._workers:
+                try:
+                    msg, info = worker.conn.recv()
+                except EOFError:
+                    raise RuntimeError('Fleet worker for devices {} exited while '
+                                       'starting'.format(worker.indices))
+                if msg == 'failed':
+                    raise RuntimeError('Fleet worker for devices {} failed to '
+                                       'start:\n{}'.format(worker.indices, info))
+
+                words = []
+                for i, (registers, register_size, addresses) in zip(worker.indices, info):
+                    self.addresses[i] = addresses
+                    self._typecodes[i] = _word_typecode(register_size)
+                    self.mirrors[i] = SimulatedRegisterState(
+                        registers, naddresses=max(addresses, default=0) + 1,
+                        register_size=register_size)
+                    words.append((len(addresses), array(self._typecodes[i]).itemsize))
+                worker.offsets, size = _layout(words, self.capacity)
+                worker.shm = shared_memory.SharedMemory(create=True, size=size)
+
+            for worker in self._workers:
+                worker.conn.send(worker.shm.name)
+        except BaseException:
+            self.stop()
+            raise
+
+    def stop(self):
+        """
+        Stops the workers and frees the shared memory.
+        """
+        for worker in self._workers:
+            if worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for worker in self._workers:
+            worker.process.join(5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+                worker.process.join()
+            worker.conn.close()
+            if worker.shm is not None:
+                worker.shm.close()
+                worker.shm.unlink()
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self):
+        return any(worker.process.is_alive() for worker in self._workers)
+
+    def _check_errors(self, worker):
+        try:
+            while worker.conn.poll():
+                _, i, error = worker.conn.recv()
+                self.errors[worker.indices[i]] = error
+        except (EOFError, OSError):
+            pass
+
+    def _counts(self, worker):
+        with worker.shm.buf[:16].cast('q') as counts:
+            return counts[0], counts[1]
+
+    def collect(self, timeout=None):
+        """
+        Returns the samples that have arrived since the last call, as a
+        dictionary mapping the index of each device (in ``devices``) to
+        ``(timestamps, raw)``.  ``timestamps`` is an array of `time.time`
+        values, and ``raw`` is a flat array of ``len(timestamps)`` rows of
+        words, with columns given by ``addresses[index]``.  Samples whose read
+        failed are left out (see `errors`).
+
+        Waits up to ``timeout`` seconds (forever if None) for a cycle to
+        finish if none have since the last call.
+        """
+        def ready():
+            return (not self.running or
+                    any(self._counts(w)[1] > w.consumed for w in self._workers))
+
+        with self._cond:
+            self._cond.wait_for(ready, timeout)
+            finished = [self._counts(w)[1] for w in self._workers]
+
+        capacity = self.capacity
+        samples = {}
+        for worker, last in zip(self._workers, finished):
+            self._check_errors(worker)
+            first = worker.consumed
+            if last == first:
+                continue
+            kept = max(first, last - capacity)
+
+            copies = []
+            view = worker.shm.buf
+            for i, (ts_offset, words_offset) in zip(worker.indices, worker.offsets):
+                typecode = self._typecodes[i]
+                nwords = len(self.addresses[i])
+                nbytes = nwords*array(typecode).itemsize
+                with view[ts_offset:ts_offset + 8*capacity].cast('d') as timestamps, \
+                        view[words_offset:words_offset + nbytes*capacity].cast(typecode) as words:
+                    ts_out = array('d')
+                    raw_out = array(typecode)
+                    for cycle in range(kept, last):
+                        slot = cycle % capacity
+                        ts_out.append(timestamps[slot])
+                        raw_out.extend(words[slot*nwords:(slot + 1)*nwords])
+                copies.append((i, ts_out, raw_out, nwords))
+
+            # slots the worker started overwriting while they were being
+            # copied can't be trusted
+            with self._cond:
+                started = self._counts(worker)[0]
+            oldest = max(kept, started - capacity)
+            for i, ts_out, raw_out, nwords in copies:
+                self.overruns[i] += oldest - first
+                timestamps = array('d')
+                raw = array(raw_out.typecode)
+                for j in range(oldest - kept, len(ts_out)):
+                    if ts_out[j] == ts_out[j]:  # not nan
+                        timestamps.append(ts_out[j])
+                        raw.extend(raw_out[j*nwords:(j + 1)*nwords])
+                samples[i] = (timestamps, raw)
+            worker.consumed = last
+        return samples
+
+    def decode(self, index, raw):
+        """
+        Decodes ``raw`` words of device ``index`` (as returned by `collect`)
+        into a numpy structured array (see `decode_snapshots`).  Requires
+        numpy.
+        """
+        from .arrays import np, decode_snapshots
+
+        if np is None:
+            raise ImportError('numpy not present, cannot decode fleet samples')
+
+        addresses = self.addresses[index]
+        raw = np.frombuffer(raw, dtype=raw.typecode).reshape(-1, len(addresses))
+        return decode_snapshots(self.mirrors[index], raw, addresses,
+                                self.devices[index].registers)
+
+    def latest(self, index, raw):
+        """
+        Sets the registers of ``mirrors[index]`` (a `SimulatedRegisterState`
+        with the register map of device ``index``) from the last sample in
+        ``raw`` (as returned by `collect`), and returns it.
+        """
+        addresses = self.addresses[index]
+        mirror = self.mirrors[index]
+        if len(raw) >= len(addresses):
+            row = raw[len(raw) - len(addresses):]
+            for addr, word in zip(addresses, row):
+                mirror._update_state_by_register(addr, word)
+        return mirror
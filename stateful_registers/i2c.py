@@ -1,23 +1,62 @@
+from functools import partial
+
 try:
     import smbus
 except ImportError:
     smbus = None
 
-from .register_state import RegisterState
+from .bus import default_bus_manager
+from .register_state import RegisterState, _read_words_into
 
 __all__ = ['I2CRegisterState']
 
 
+# the most bytes an SMBus block transfer can move
+_I2C_BLOCK_BYTES = 32
+
+
 class I2CRegisterState(RegisterState):
+    """
+    register_size : int
+        Bits per register word.  Words wider than 8 bits are moved as
+        ``register_size // 8`` bytes each in ``byteorder``, with bursts of
+        them in one block transfer.
+    byteorder : 'big' or 'little'
+        The byte order of words wider than 8 bits.
+    bus_manager : BusManager or None
+        The manager to get the shared ``SMBus`` handle and bus lock from.  If
+        None, use ``default_bus_manager``.
+    """
+    _max_block_size = _I2C_BLOCK_BYTES
+    # at 100 kHz each byte is ~90 us, and a register read costs ~4 bytes of
+    # addressing on top of the data
+    _transaction_cost = 400.
+    _byte_cost = 90.
+
     def __init__(self, registers, device_address, i2c_bus=1, register_size=8,
-             write_bit=7):
+             write_bit=7, bus_manager=None, threadsafe=False,
+             byteorder='big'):
         if smbus is None:
             raise ImportError('smbus not present, cannot use I2CRegisterState')
 
-        super().__init__(registers, register_size)
-        self.bus = smbus.SMBus(i2c_bus)
+        super().__init__(registers, register_size, threadsafe, byteorder)
+        self._max_block_size = _I2C_BLOCK_BYTES // self._word_bytes
+        self._bus_key = ('i2c', i2c_bus)
+        if bus_manager is None:
+            bus_manager = default_bus_manager
+        self._bus_manager = bus_manager
+        self.bus, self._bus_lock = bus_manager.get_i2c(i2c_bus)
         self.device_address = device_address
 
+    def close(self):
+        """
+        Releases this state's reference to the shared bus handle.
+        """
+        if self.bus is not None:
+            self._bus_manager.release(self._bus_key)
+            self.bus = None
+        super().close()
+
     @property
     def device_address(self):
         return self._device_address
@@ -28,20 +67,58 @@ class I2CRegisterState(RegisterState):
         self._device_address = val
 
     def _read_register(self, address, ntimes=None):
-        if ntimes is None:
-            return self.bus.read_byte_data(self._device_address, address)
-        elif ntimes > 32:
-            raise ValueError('i2c cannot read more than 32 bytes at once, asked'
-                             ' for {}'.format(ntimes))
-        else:
-            return self.bus.read_i2c_block_data(self._device_address, address, ntimes)
+        wb = self._word_bytes
+        if ntimes is None and wb == 1:
+            with self._bus_lock:
+                return self.bus.read_byte_data(self._device_address, address)
+
+        nbytes = (1 if ntimes is None else ntimes)*wb
+        if nbytes > _I2C_BLOCK_BYTES:
+            raise ValueError('i2c cannot read more than {} bytes at once, asked'
+                             ' for {}'.format(_I2C_BLOCK_BYTES, nbytes))
+        with self._bus_lock:
+            buf = self.bus.read_i2c_block_data(self._device_address, address,
+                                               nbytes)
+        if wb == 1:
+            return buf
+        words = self._unpack_words(buf)
+        return words[0] if ntimes is None else words
+
+    def _read_into(self, address, buf):
+        """
+        smbus only returns block reads as a new list, so unlike SPI this
+        can't avoid building a list for each burst.  For 8-bit registers it
+        at least copies the list straight into ``buf``.
+        """
+        if self._word_bytes > 1:
+            # not through self._read_register, which is recorded separately
+            # when instrumented
+            _read_words_into(partial(type(self)._read_register, self), address,
+                             buf)
+            return
+
+        n = len(buf)
+        if n > _I2C_BLOCK_BYTES:
+            raise ValueError('i2c cannot read more than {} bytes at once, asked'
+                             ' for {}'.format(_I2C_BLOCK_BYTES, n))
+        with self._bus_lock:
+            buf[:] = bytes(self.bus.read_i2c_block_data(self._device_address,
+                                                        address, n))
 
     def _write_register(self, address, value):
+        wb = self._word_bytes
         if isinstance(value, int):
-            self.bus.write_byte_data(self._device_address, address, value)
-        elif len(value) > 32:
-            raise ValueError('i2c cannot write more than 32 bytes at once, '
-                             'tried to write {}'.format(len(value)))
-        else:
-            # assume multi-write
-            self.bus.write_i2c_block_data(self._device_address, address, value)
+            if wb == 1:
+                with self._bus_lock:
+                    self.bus.write_byte_data(self._device_address, address, value)
+                return
+            value = [value]
+
+        nbytes = len(value)*wb
+        if nbytes > _I2C_BLOCK_BYTES:
+            raise ValueError('i2c cannot write more than {} bytes at once, '
+                             'tried to write {}'.format(_I2C_BLOCK_BYTES, nbytes))
+        data = list(value) if wb == 1 else list(self._pack_words(value))
+        # assume multi-write
+        with self._bus_lock:
+            self.bus.write_i2c_block_data(self._device_address, address, data)
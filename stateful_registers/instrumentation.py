@@ -0,0 +1,142 @@
+"""
+Opt-in instrumentation of the bus transactions of a `RegisterState`.  See
+`RegisterState.instrument`.
+"""
+import time
+
+from collections import defaultdict, namedtuple
+
+__all__ = ['TransactionStats', 'Transaction']
+
+
+#: A single bus transaction, as given to instrumentation callbacks.
+#: ``kind`` is 'read' or 'write', ``argument`` is the ``ntimes`` of a read or
+#: the value of a write, ``result`` is what a read returned (None for
+#: writes), and ``start``/``duration`` are in seconds from
+#: `time.perf_counter`.
+Transaction = namedtuple('Transaction', ['kind', 'address', 'argument',
+                                         'result', 'start', 'duration'])
+
+
+class TransactionStats:
+    """
+    Accumulated statistics of the bus transactions of a `RegisterState`.
+
+    Parameters
+    ----------
+    address_bin : int
+        Width of the address ranges that transactions are counted in.
+    """
+    def __init__(self, address_bin=16):
+        self.address_bin = address_bin
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.writes = 0
+        self.words_read = 0
+        self.words_written = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.read_modify_writes = 0
+        self.total_time = 0.
+        # log2 bins of microseconds: bin 0 is < 1 us, bin k is [2**(k-1), 2**k) us
+        self._latency_bins = defaultdict(int)
+        self._address_counts = defaultdict(int)
+
+    @property
+    def transactions(self):
+        return self.reads + self.writes
+
+    @property
+    def latency_histogram(self):
+        """
+        A list of ``(upper_edge_us, count)`` for the transaction latencies,
+        in log2 bins.
+        """
+        return [(2**k, self._latency_bins[k]) for k in sorted(self._latency_bins)]
+
+    @property
+    def address_counts(self):
+        """
+        A dictionary mapping the start of each address range (of width
+        ``address_bin``) to the number of transactions starting in it.
+        """
+        return dict(sorted(self._address_counts.items()))
+
+    def record(self, kind, address, nwords, nbytes, duration):
+        if kind == 'read':
+            self.reads += 1
+            self.words_read += nwords
+            self.bytes_read += nbytes
+        else:
+            self.writes += 1
+            self.words_written += nwords
+            self.bytes_written += nbytes
+        self.total_time += duration
+        self._latency_bins[int(duration*1e6).bit_length()] += 1
+        self._address_counts[address - address % self.address_bin] += 1
+
+    def __repr__(self):
+        return ('<TransactionStats reads={} writes={} bytes_read={} '
+                'bytes_written={} read_modify_writes={} total_time={:.6f}>'
+                ''.format(self.reads, self.writes, self.bytes_read,
+                          self.bytes_written, self.read_modify_writes,
+                          self.total_time))
+
+
+def _instrument(state, stats, callback):
+    """
+    Wraps the ``_read_register`` and ``_write_register`` of ``state`` (as
+    instance attributes, so removing them restores the class methods).
+    """
+    read_register = state._read_register
+    write_register = state._write_register
+    word_bytes = state.word_bytes
+    clock = time.perf_counter
+
+    def _read_register(address, ntimes=None):
+        start = clock()
+        result = read_register(address, ntimes)
+        duration = clock() - start
+        nwords = 1 if ntimes is None else ntimes
+        if stats is not None:
+            stats.record('read', address, nwords, nwords*word_bytes, duration)
+        if callback is not None:
+            callback(Transaction('read', address, ntimes, result, start, duration))
+        return result
+
+    def _write_register(address, value):
+        start = clock()
+        write_register(address, value)
+        duration = clock() - start
+        nwords = 1 if isinstance(value, int) else len(value)
+        if stats is not None:
+            stats.record('write', address, nwords, nwords*word_bytes, duration)
+        if callback is not None:
+            callback(Transaction('write', address, value, None, start, duration))
+
+    state._read_register = _read_register
+    state._write_register = _write_register
+
+    # backends that fill buffers directly bypass _read_register, so they
+    # need wrapping too (the default goes through the wrapper above)
+    from .register_state import RegisterState
+
+    if type(state)._read_into is not RegisterState._read_into:
+        read_into = state._read_into
+
+        def _read_into(address, buf):
+            start = clock()
+            read_into(address, buf)
+            duration = clock() - start
+            nwords = len(buf)
+            if stats is not None:
+                stats.record('read', address, nwords, nwords*word_bytes, duration)
+            if callback is not None:
+                result = buf[0] if nwords == 1 else buf.tolist()
+                argument = None if nwords == 1 else nwords
+                callback(Transaction('read', address, argument, result, start,
+                                     duration))
+
+        state._read_into = _read_into
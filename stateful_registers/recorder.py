@@ -0,0 +1,288 @@
+"""
+A compact binary log of timestamped raw register snapshots.
+
+The file starts with a header giving the register map (so a log can be read
+back without the code that made it), followed by fixed-size records of a
+float64 timestamp and the raw words of one snapshot.  Since every record is
+the same size, `SnapshotReader` can memory-map the log and pull out any
+column (or decode any field) over any range of records without parsing or
+loading the rest.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .register_state import (RegisterValue, MultiRegisterValue,
+                             _word_typecode)
+from .simulated import SimulatedRegisterState
+
+__all__ = ['SnapshotRecorder', 'SnapshotReader']
+
+_MAGIC = b'SRSNAP\x00\x01'
+# magic, then the length of the JSON header
+_PREAMBLE = struct.Struct('<8sI')
+
+
+def _schema(state, addresses):
+    """
+    The JSON-able description of ``state``'s register map written in the
+    header.
+    """
+    regs = [{'name': r.name, 'address': r.address, 'offset': r.offset,
+             'nbits': r.nbits}
+            for r in state._field_regs]
+    multis = [{'name': mr.name, 'registers': [r.name for r in mr.registers]}
+              for mr in state._name_to_multireg.values()]
+    typecode = _word_typecode(state.register_size)
+    return {'register_size': state.register_size,
+            'word_type': typecode,
+            'word_bytes': array(typecode).itemsize,
+            'byteorder': sys.byteorder,
+            'addresses': list(addresses),
+            'registers': regs,
+            'multiregisters': multis}
+
+
+def _read_header(f):
+    magic, n = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+    if magic != _MAGIC:
+        raise ValueError('{} is not a register snapshot log'.format(f.name))
+    return json.loads(f.read(n).decode('utf-8')), _PREAMBLE.size + n
+
+
+class SnapshotRecorder:
+    """
+    Appends timestamped raw snapshots of a `RegisterState` to a binary log.
+
+    Each `record` reads the registers through a `BurstBuffer` and appends
+    the raw words, without decoding them.  If ``fn`` already exists and was
+    recorded with the same register map and addresses, it is appended to.
+
+    Parameters
+    ----------
+    state : RegisterState
+        The state to record.
+    fn : str
+        The log file.
+    registers : sequence or None
+        The registers (or names) to record, or None for all of them.
+    groupread : bool or 'auto'
+        How to group the addresses into bursts, as in
+        `RegisterState.burst_buffer`.  All the words read are recorded,
+        including any in gaps that are read through.
+    """
+    def __init__(self, state, fn, registers=None, groupread='auto'):
+        self.state = state
+        self.fn = fn
+        self._buffer = state.burst_buffer(registers, groupread)
+        self.addresses = self._buffer.addresses
+        schema = _schema(state, self.addresses)
+
+        if os.path.exists(fn) and os.path.getsize(fn) > 0:
+            with open(fn, 'rb') as f:
+                existing, header_size = _read_header(f)
+            if existing != schema:
+                raise ValueError('{} was recorded with a different register map '
+                                 'or addresses'.format(fn))
+            self._file = open(fn, 'ab')
+            # drop a partial record left by an interrupted write
+            record_size = 8 + len(self.addresses)*schema['word_bytes']
+            extra = (os.path.getsize(fn) - header_size) % record_size
+            if extra:
+                self._file.truncate(os.path.getsize(fn) - extra)
+        else:
+            header = json.dumps(schema).encode('utf-8')
+            self._file = open(fn, 'wb')
+            self._file.write(_PREAMBLE.pack(_MAGIC, len(header)))
+            self._file.write(header)
+
+        self._timestamp = array('d', [0.])
+
+    def record(self, timestamp=None):
+        """
+        Reads the registers and appends a snapshot, with ``timestamp`` (or the
+        current `time.time` if None).
+        """
+        self._buffer.read()
+        self._timestamp[0] = time.time() if timestamp is None else timestamp
+        self._file.write(self._timestamp)
+        self._file.write(self._buffer.buffer)
+
+    def write(self, timestamps, raw):
+        """
+        Appends snapshots that were read some other way (e.g. the blocks of a
+        `RegisterStream` with the same addresses).  ``raw`` is a flat sequence
+        of ``len(timestamps)`` rows of words.
+        """
+        nwords = len(self.addresses)
+        if len(raw) != len(timestamps)*nwords:
+            raise ValueError('raw has {} words, expected {} for {} '
+                             'snapshots'.format(len(raw), len(timestamps)*nwords,
+                                                len(timestamps)))
+        typecode = self._buffer.buffer.typecode
+        for i, timestamp in enumerate(timestamps):
+            self._file.write(array('d', [timestamp]))
+            self._file.write(array(typecode, raw[i*nwords:(i + 1)*nwords]))
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SnapshotReader:
+    """
+    Reads a log written by `SnapshotRecorder`, by memory-mapping it.  Nothing
+    is decoded until asked for, and the `time`, `raw`, and `column` arrays
+    are views of the file rather than copies.  Requires numpy.
+
+    Parameters
+    ----------
+    fn : str
+        The log file.
+
+    Attributes
+    ----------
+    addresses : list of int
+        The address of each word of a snapshot.
+    state : SimulatedRegisterState
+        A state with the recorded register map, used for decoding.
+    """
+    def __init__(self, fn):
+        if np is None:
+            raise ImportError('numpy not present, cannot use SnapshotReader')
+
+        self.fn = fn
+        with open(fn, 'rb') as f:
+            self.schema, self._header_size = _read_header(f)
+
+        schema = self.schema
+        self.addresses = schema['addresses']
+        regs = {r['name']: RegisterValue(r['name'], r['address'], r['offset'],
+                                         r['nbits'])
+                for r in schema['registers']}
+        multis = [MultiRegisterValue(mr['name'], [regs[nm] for nm in mr['registers']])
+                  for mr in schema['multiregisters']]
+        self.state = SimulatedRegisterState(
+            list(regs.values()) + multis,
+            naddresses=max(self.addresses, default=0) + 1,
+            register_size=schema['register_size'])
+
+        order = '<' if schema['byteorder'] == 'little' else '>'
+        word_dtype = np.dtype('{}u{}'.format(order, schema['word_bytes']))
+        self._dtype = np.dtype([('time', order + 'f8'),
+                                ('raw', word_dtype, (len(self.addresses),))])
+        self._file = None
+        self._mmap = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        Maps the file again, to pick up snapshots appended since it was
+        opened.
+        """
+        self._release()
+        self._file = open(self.fn, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        nrecords = (size - self._header_size) // self._dtype.itemsize
+        if nrecords > 0:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.records = np.frombuffer(self._mmap, dtype=self._dtype,
+                                         count=nrecords, offset=self._header_size)
+        else:
+            self.records = np.empty(0, dtype=self._dtype)
+
+    def _release(self):
+        self.records = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # arrays from it are still around, it'll go when they do
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def time(self):
+        """
+        The timestamp of each snapshot.
+        """
+        return self.records['time']
+
+    @property
+    def raw(self):
+        """
+        The (N_snapshots x N_addresses) raw words.
+        """
+        return self.records['raw']
+
+    def column(self, address):
+        """
+        The raw word at ``address`` in each snapshot.
+        """
+        return self.raw[:, self.addresses.index(address)]
+
+    def time_slice(self, start=None, stop=None):
+        """
+        A `slice` of the snapshots with ``start <= time < stop``, assuming they
+        were recorded in time order.
+        """
+        times = self.time
+        lo = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+        hi = len(times) if stop is None else int(np.searchsorted(times, stop, 'left'))
+        return slice(lo, hi)
+
+    def field(self, register, index=slice(None)):
+        """
+        Decodes just the value of ``register`` (a name, `RegisterValue` or
+        `MultiRegisterValue`) in the snapshots selected by ``index``.
+        """
+        return self.decode([register], index)[self._name(register)]
+
+    def decode(self, registers=None, index=slice(None)):
+        """
+        Decodes the snapshots selected by ``index`` into a numpy structured
+        array (see `decode_snapshots`), with an added ``'time'`` field.
+        """
+        from .arrays import decode_snapshots, _with_time
+
+        records = self.records[index]
+        decoded = decode_snapshots(self.state, records['raw'], self.addresses,
+                                   registers)
+        return _with_time(records['time'], decoded)
+
+    def _name(self, register):
+        return register if isinstance(register, str) else register.name
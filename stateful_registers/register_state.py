@@ -6,16 +6,35 @@ that overrides most of the initializer's keywords with whatever the correct
 options are for the specific peripheral.
 """
 import copy
+import itertools
+import struct
+import threading
+import time
+import weakref
 
+from array import array
 from abc import ABC, abstractmethod
 from collections import defaultdict, OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
 
-__all__ = ['RegisterState', 'RegisterValue', 'MultiRegisterValue']
+from .aio import run_on_bus, release_bus_executor
+from .instrumentation import TransactionStats, _instrument
+
+__all__ = ['RegisterState', 'RegisterValue', 'MultiRegisterValue',
+           'BurstBuffer', 'ReadRequest']
+
+# numbers the states that get a bus (and executor) of their own
+_state_ids = itertools.count()
 
 
 class RegisterValue:
+    __slots__ = ('name', 'address', '_offset', '_nbits', 'description',
+                 'writeable', 'cache', '_value', '_dirty', '_state',
+                 '_bitmask', '_limit')
+
     def __init__(self, name, address, offset=0, nbits=1,
-                       description='', writeable=None):
+                       description='', writeable=None, cache=None):
         """
         name : str
             Name of the register value
@@ -30,14 +49,22 @@ class RegisterValue:
         writeable : bool or None
             Whether the value is writeable, or None for "unspecified"
             (effectively writeable but need to check after)
+        cache : None, 'volatile', 'constant', or float
+            How long a read of this value stays fresh for `read_state`: None
+            or 'volatile' means always read it, 'constant' means read it once,
+            and a number is a time-to-live in seconds.
         """
         self.name = name
         self.address = address
-        self.offset = offset
-        self.nbits = nbits
+        self._offset = offset
+        self.nbits = nbits  # also sets the precomputed bitmask and limit
         self.description = description
         self.writeable = writeable
+        self.cache = cache
         self._value = None
+        self._dirty = False
+        # set by the owning RegisterState so it can track dirty addresses
+        self._state = None
 
     _infofields = ('name', 'address', 'offset', 'nbits', 'writeable',
                    'description', 'value')
@@ -48,23 +75,51 @@ class RegisterValue:
     def copy(self):
         return copy.copy(self)
 
+    @property
+    def offset(self):
+        return self._offset
+    @offset.setter
+    def offset(self, val):
+        self._offset = val
+        self._bitmask = self._limit - 1 << val
+
+    @property
+    def nbits(self):
+        return self._nbits
+    @nbits.setter
+    def nbits(self, val):
+        self._nbits = val
+        self._limit = 2**val
+        self._bitmask = self._limit - 1 << self._offset
+
     @property
     def bitmask(self):
-        return 2**self.nbits - 1 << self.offset
+        return self._bitmask
 
     @property
     def register_value(self):
         return self._value << self.offset
 
+    @property
+    def dirty(self):
+        """
+        True if the value has been set since it was last read from or written
+        to the device.
+        """
+        return self._dirty
+
     @property
     def value(self):
         return self._value
     @value.setter
     def value(self, val):
-        if val >= 2**self.nbits:
+        if val >= self._limit:
             raise ValueError('Value {} does not fit into {} bits (register '
                              'value {})'.format(val, self.nbits, self.name))
         self._value = val
+        self._dirty = True
+        if self._state is not None:
+            self._state._dirty_addrs.add(self.address)
 
 
 class MultiRegisterValue:
@@ -76,6 +131,8 @@ class MultiRegisterValue:
     description : str
         A human-readable description
     """
+    __slots__ = ('name', '_registers', '_shifts', 'description', '_state')
+
     def __init__(self, name, registers, description=''):
         """
         name :
@@ -83,35 +140,422 @@ class MultiRegisterValue:
         self.name = name
         self.registers = tuple(registers)
         self.description = description
+        # set by the owning RegisterState, to lock a thread-safe state
+        self._state = None
 
         for r in self.registers:
             if not isinstance(r, RegisterValue):
                 raise TypeError('registers in MultiRegisterValue must be RegisterValues')
 
     @property
-    def value(self):
-        val = 0
+    def registers(self):
+        return self._registers
+    @registers.setter
+    def registers(self, val):
+        self._registers = tuple(val)
+
+        # precompute where each register lands in the assembled value
+        shifts = []
         bitsdone = 0
-        for r in self.registers:
-            val |= r.value << bitsdone
+        for r in self._registers:
+            shifts.append(bitsdone)
             bitsdone += r.nbits
-        return val
+        self._shifts = tuple(shifts)
+
+    @property
+    def value(self):
+        state = self._state
+        if state is not None and state._addr_locks is not None:
+            # don't let a read in another thread change some of the registers
+            # part way through
+            with state._locked((r.address for r in self._registers),
+                               bus=False):
+                return self._assemble()
+        return self._assemble()
     @value.setter
     def value(self, val):
         raise NotImplementedError
 
+    def _assemble(self):
+        val = 0
+        for r, shift in zip(self._registers, self._shifts):
+            val |= r._value << shift
+        return val
+
     def copy(self):
         return copy.copy(self)
 
 
+def _plan_runs(addrs, max_length=None):
+    """
+    Groups the sorted sequence ``addrs`` into runs of contiguous addresses.
+    Returns a list of ``(start_address, length)`` tuples, with runs split so
+    that none are longer than ``max_length`` (if not None).
+    """
+    runs = []
+    start = prev = None
+    for addr in addrs:
+        if (start is not None and addr == prev + 1 and
+                (max_length is None or addr - start < max_length)):
+            prev = addr
+            continue
+        if start is not None:
+            runs.append((start, prev - start + 1))
+        start = prev = addr
+    if start is not None:
+        runs.append((start, prev - start + 1))
+    return runs
+
+
+def _plan_bursts(addrs, transaction_cost, word_cost, max_length=None):
+    """
+    Splits the sorted sequence ``addrs`` into ``(start_address, length)``
+    bursts minimizing ``transaction_cost`` per burst plus ``word_cost`` per
+    word read (including the unused words in gaps), with no burst longer than
+    ``max_length`` (if not None).
+    """
+    addrs = list(addrs)
+    if max_length is None:
+        # without a length limit each gap can be decided on its own
+        runs = []
+        start = prev = None
+        for addr in addrs:
+            if start is not None and (addr - prev - 1)*word_cost < transaction_cost:
+                prev = addr
+                continue
+            if start is not None:
+                runs.append((start, prev - start + 1))
+            start = prev = addr
+        if start is not None:
+            runs.append((start, prev - start + 1))
+        return runs
+
+    # otherwise dynamic programming over where each burst starts: best[i] is
+    # the cost of reading addrs[:i], and from[i] where its last burst starts
+    best = [0.]
+    from_idx = [0]
+    for i, addr in enumerate(addrs):
+        best.append(None)
+        from_idx.append(None)
+        j = i
+        while j >= 0 and addr - addrs[j] < max_length:
+            cost = best[j] + transaction_cost + (addr - addrs[j] + 1)*word_cost
+            if best[i + 1] is None or cost < best[i + 1]:
+                best[i + 1] = cost
+                from_idx[i + 1] = j
+            j -= 1
+
+    runs = []
+    i = len(addrs)
+    while i > 0:
+        j = from_idx[i]
+        runs.append((addrs[j], addrs[i - 1] - addrs[j] + 1))
+        i = j
+    return runs[::-1]
+
+
+# the plans of recently read address sets, bounded since the stale and dirty
+# subsets read by a long-running poller keep turning up new ones
+_cached_plan_bursts = lru_cache(maxsize=512)(_plan_bursts)
+
+_NULL_CONTEXT = nullcontext()
+
+
+def _check_word(addr, regs, register_size):
+    """
+    Raises a ValueError if the registers ``regs`` at ``addr`` overlap or don't
+    fit in a word of ``register_size`` bits.
+    """
+    bits_set = 0
+    for reg in regs:
+        if reg.bitmask & bits_set != 0:
+            raise ValueError('Registers overlap in address '
+                             '{}: {}'.format(addr, regs))
+        bits_set |= reg.bitmask
+    if bits_set >= 2**register_size:
+        raise ValueError('Register values go past the word size in address {}: {}'.format(addr, regs))
+
+
+def _address_ttl(regs):
+    """
+    How long a read of an address with the registers ``regs`` stays fresh:
+    the shortest time of the registers, or None if any are volatile.
+    """
+    ttls = []
+    for reg in regs:
+        if reg.cache is None or reg.cache == 'volatile':
+            return None
+        elif reg.cache == 'constant':
+            ttls.append(float('inf'))
+        elif isinstance(reg.cache, (int, float)):
+            ttls.append(reg.cache)
+        else:
+            raise ValueError('Unrecognized cache policy {!r} for register '
+                             '{}'.format(reg.cache, reg.name))
+    return min(ttls)
+
+
+# struct codes for unpacking words of a given number of bytes
+_STRUCT_CODES = {2: 'H', 4: 'I', 8: 'Q'}
+
+
+def _word_typecode(register_size):
+    """
+    The `array` typecode that holds words of ``register_size`` bits.
+    """
+    if register_size <= 8:
+        return 'B'
+    elif register_size <= 16:
+        return 'H'
+    elif register_size <= 32:
+        return 'I'
+    else:
+        return 'Q'
+
+
+def _read_words_into(read_register, address, buf):
+    """
+    Fills ``buf`` with the words ``read_register`` (a ``_read_register``)
+    returns for ``len(buf)`` addresses from ``address``.
+    """
+    if len(buf) == 1:
+        buf[0] = read_register(address)
+    else:
+        vals = read_register(address, len(buf))
+        for i in range(len(buf)):
+            buf[i] = vals[i]
+
+
+class BurstBuffer:
+    """
+    A preallocated transfer buffer for reading a fixed set of bursts, and
+    decoding them straight from the buffer.
+
+    Reads go through `RegisterState._read_into` into views of one
+    `array.array`, and decoding walks a table of (buffer offset, register,
+    mask, shift) worked out up front, so neither allocates per read beyond
+    what the backend itself does.  Use `RegisterState.burst_buffer` to make
+    one.  This does not use or update the `read_state` cache.
+
+    Attributes
+    ----------
+    plan : list of (start_address, length)
+        The bursts.
+    addresses : list of int
+        The address of each word of `buffer`.
+    buffer : array.array
+        The raw words of the last read.
+    """
+    def __init__(self, state, plan):
+        self.state = state
+        self.plan = list(plan)
+        self.addresses = [start + i for start, n in self.plan for i in range(n)]
+        typecode = _word_typecode(state.register_size)
+        self.buffer = array(typecode,
+                            bytes(len(self.addresses)*array(typecode).itemsize))
+
+        view = memoryview(self.buffer)
+        self._bursts = []
+        offset = 0
+        for start, n in self.plan:
+            self._bursts.append((start, view[offset:offset + n]))
+            offset += n
+
+        # the fields in buffer order, and where each comes from
+        self._decode = []
+        self._decoded_addrs = []
+        for i, addr in enumerate(self.addresses):
+            ai = state._addr_index.get(addr)
+            if ai is None:
+                continue
+            self._decoded_addrs.append((i, addr))
+            for fi in range(state._field_starts[ai], state._field_starts[ai + 1]):
+                self._decode.append((i, state._field_regs[fi],
+                                     state._field_masks[fi],
+                                     state._field_shifts[fi]))
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def word(self, address):
+        """
+        The raw word at ``address`` from the last read.
+        """
+        return self.buffer[self.addresses.index(address)]
+
+    def read(self):
+        """
+        Reads the bursts from the device into `buffer`.
+        """
+        read_into = self.state._read_into
+        for start, view in self._bursts:
+            read_into(start, view)
+
+    def decode(self):
+        """
+        Sets the register values from the words in `buffer`.
+        """
+        state = self.state
+        buf = self.buffer
+        for i, regv, mask, shift in self._decode:
+            regv._value = (buf[i] & mask) >> shift
+            regv._dirty = False
+
+        raw_words = state._raw_words
+        dirty = state._dirty_addrs
+        for i, addr in self._decoded_addrs:
+            raw_words[addr] = buf[i]
+            if dirty and addr in dirty:
+                dirty.discard(addr)
+
+    def update(self):
+        """
+        Reads and then decodes, holding the address locks of a thread-safe
+        state throughout.
+        """
+        with self.state._locked(self.addresses):
+            self.read()
+            self.decode()
+
+
+class ReadRequest:
+    """
+    A `RegisterState.read_state` call worked out up front, for reading the
+    same registers over and over.  Use `RegisterState.prepare_read` to make
+    one.
+
+    The registers are sorted out once into groups of addresses (and how to
+    read each group) and the set of registers to update, so `execute` only
+    does the reads and the decoding.
+
+    Attributes
+    ----------
+    addresses : list of int
+        All the addresses read.
+    groups : list of (addresses, groupread)
+        The addresses read together, and the ``groupread`` they are read with.
+    """
+    def __init__(self, state, registers, groupread='multi', update_all=True,
+                 use_cache=True):
+        self.state = state
+        self.use_cache = use_cache
+
+        # dicts rather than sets to keep the order the registers were given in
+        singles = {}
+        multis = {}
+        for reg in registers:
+            if isinstance(reg, str):
+                reg = state.get_register(reg)
+            if isinstance(reg, MultiRegisterValue):
+                multis[reg] = None
+            else:
+                singles[reg] = None
+        subregisters = {}
+        for mr in multis:
+            subregisters.update(dict.fromkeys(mr.registers))
+
+        if groupread == 'multi':
+            # registers that are part of a multi are read along with it
+            plain = [reg for reg in singles if reg not in subregisters]
+            groups = [(state._addresses_of(plain), False)]
+            for mr in multis:
+                groups.append((state._addresses_of(mr.registers), True))
+        else:
+            singles.update(subregisters)
+            groups = [(state._addresses_of(singles), groupread)]
+        self.groups = [(addrs, gr) for addrs, gr in groups if addrs]
+        self.addresses = sorted({addr for addrs, _ in self.groups
+                                 for addr in addrs})
+
+        # grouped reads can read (and so update) the addresses in between
+        # too, so those need locking as well
+        locked = set()
+        for addrs, gr in self.groups:
+            if gr:
+                locked.update(range(addrs[0], addrs[-1] + 1))
+            else:
+                locked.update(addrs)
+        self._lock_addrs = sorted(locked)
+
+        if update_all:
+            self._regs_to_check = None
+        else:
+            self._regs_to_check = frozenset(singles).union(subregisters)
+
+    def execute(self):
+        """
+        Reads the registers from the device and updates the state.  Returns a
+        dictionary of the raw words read, like `RegisterState.read_state`.
+        """
+        state = self.state
+        read = (state._read_addresses_cached if self.use_cache
+                else state._read_addresses)
+        update = state._update_state_by_register
+        r2c = self._regs_to_check
+
+        raw_values = {}
+        with state._locked(self._lock_addrs):
+            for addrs, groupread in self.groups:
+                raw = read(addrs, groupread)
+                for addr, rawval in raw.items():
+                    update(addr, rawval, regs_to_check=r2c)
+                raw_values.update(raw)
+        return raw_values
+
+
 class RegisterState(ABC):
-    def __init__(self, registers, register_size=8):
+    #: Whether the device supports writing contiguous addresses in a single
+    #: (auto-incrementing) block write.
+    block_writes = True
+
+    #: The maximum number of words the backend can move in one transaction, or
+    #: None for no limit.
+    _max_block_size = None
+
+    #: Rough cost (in microseconds) of starting a bus transaction and of
+    #: moving each byte, used to plan grouped reads.
+    _transaction_cost = 100.
+    _byte_cost = 10.
+
+    #: Identifies the bus this state talks over (see `bus_key`), set by
+    #: backends that can share a bus with other states.
+    _bus_key = None
+    #: The lock backends hold for each bus transaction, if they have one
+    #: (see `BusManager`).
+    _bus_lock = None
+    # the key and finalizer for the executor of a state without a _bus_key
+    _own_bus_key = None
+    _executor_finalizer = None
+
+    def __init__(self, registers, register_size=8, threadsafe=False,
+                 byteorder='big'):
+        if byteorder not in ('big', 'little'):
+            raise ValueError('byteorder must be "big" or "little", not '
+                             '{}'.format(byteorder))
         self._register_size = register_size
-        self._update_registers(registers)
+        self._word_bytes = max(1, -(-register_size // 8))
+        self.byteorder = byteorder
+        self._stats = None
+        self._threadsafe = threadsafe
+
+        # imported here since regmap needs this module
+        from .regmap import RegisterMap
+
+        if isinstance(registers, RegisterMap):
+            self._use_register_map(registers)
+        else:
+            self._update_registers(registers)
 
     def _update_registers(self, regs):
         self._name_to_reg = {r.name: r.copy() for r in regs
                              if not isinstance(r, MultiRegisterValue)}
+        for r in self._name_to_reg.values():
+            r._state = self
+
+        # addresses with registers that have been set locally but not written
+        self._dirty_addrs = set()
+        # the last word read from or written to each address
+        self._raw_words = {}
 
         # create the MultiRegisterValue's but re-link them to the *copied*
         # registers created above
@@ -119,6 +563,7 @@ class RegisterState(ABC):
                                   if isinstance(r, MultiRegisterValue)}
         for mr in self._name_to_multireg.values():
             mr.registers = tuple((self._name_to_reg[r.name] for r in mr.registers))
+            mr._state = self
 
         addr_to_regs_temp = defaultdict(list)
         for r in self._name_to_reg.values():
@@ -127,16 +572,122 @@ class RegisterState(ABC):
         for addr in addr_to_regs_temp:
             addr_to_regs_temp[addr].sort(key=lambda val: val.offset)
             a2r[addr] = regs = tuple(addr_to_regs_temp[addr])
+            _check_word(addr, regs, self.register_size)
+
+        self._compile_decode_table()
+
+        self._compile_cache_policy()
+        self._make_locks()
+
+    def _use_register_map(self, regmap):
+        """
+        Like `_update_registers`, but for a `RegisterMap`, which has already
+        been validated and compiled.  The registers are made directly from its
+        fields, and its decoding tables are shared rather than rebuilt.
+        """
+        if regmap.register_size != self._register_size:
+            raise ValueError('RegisterMap is for {}-bit registers, not '
+                             '{}'.format(regmap.register_size, self._register_size))
+
+        new_reg = RegisterValue.__new__
+        regs = []
+        for field, (bitmask, limit) in zip(regmap.fields, regmap.field_limits):
+            r = new_reg(RegisterValue)
+            (r.name, r.address, r._offset, r._nbits, r.description,
+             r.writeable, r.cache) = field
+            r._bitmask = bitmask
+            r._limit = limit
+            r._value = None
+            r._dirty = False
+            r._state = self
+            regs.append(r)
+        self._name_to_reg = {r.name: r for r in regs}
+
+        self._dirty_addrs = set()
+        self._raw_words = {}
+
+        new_multi = MultiRegisterValue.__new__
+        self._name_to_multireg = {}
+        for (name, idxs, description), shifts in zip(regmap.multiregisters,
+                                                     regmap.multi_shifts):
+            mr = new_multi(MultiRegisterValue)
+            mr.name = name
+            mr._registers = tuple(regs[i] for i in idxs)
+            mr._shifts = shifts
+            mr.description = description
+            mr._state = self
+            self._name_to_multireg[name] = mr
+
+        self._field_regs = fregs = tuple(regs[i] for i in regmap.field_order)
+        starts = regmap.field_starts
+        self._addr_to_regs = OrderedDict(
+            (addr, fregs[starts[i]:starts[i + 1]])
+            for i, addr in enumerate(regmap.decode_addrs))
+
+        # these are never changed, so every state with the map can share them
+        self._decode_addrs = regmap.decode_addrs
+        self._addr_index = regmap.addr_index
+        self._field_starts = starts
+        self._field_masks = regmap.field_masks
+        self._field_shifts = regmap.field_shifts
+        self._addr_ttl = regmap.addr_ttl
+        self._read_times = {}
+
+        self._make_locks()
+
+    def _make_locks(self):
+        if self._threadsafe:
+            self._addr_locks = {addr: threading.RLock() for addr in self._addr_to_regs}
+        else:
+            self._addr_locks = None
 
-            # validate that there are no overlapping register words
-            bits_set = 0
-            for reg in regs:
-                if reg.bitmask & bits_set != 0:
-                    raise ValueError('Registers overlap in address '
-                                     '{}: {}'.format(addr, regs))
-                bits_set |= reg.bitmask
-            if bits_set >= 2**self.register_size:
-                raise ValueError('Register values go past the word size in address {}: {}'.format(addr, regs))
+    def _compile_decode_table(self):
+        """
+        Precomputes flat tables used to decode raw words without going through
+        the `RegisterValue` properties. The fields are ordered by address and
+        offset, and the fields of the address at index ``i`` of
+        ``_decode_addrs`` are ``_field_starts[i]:_field_starts[i+1]``.
+        """
+        addrs = sorted(self._addr_to_regs)
+        regs = [r for addr in addrs for r in self._addr_to_regs[addr]]
+
+        self._decode_addrs = array('l', addrs)
+        self._addr_index = {addr: i for i, addr in enumerate(addrs)}
+        starts = [0]
+        for addr in addrs:
+            starts.append(starts[-1] + len(self._addr_to_regs[addr]))
+        self._field_starts = array('l', starts)
+
+        self._field_regs = tuple(regs)
+        masktype = 'Q' if self._register_size <= 64 else None
+        masks = [r.bitmask for r in regs]
+        self._field_masks = masks if masktype is None else array(masktype, masks)
+        self._field_shifts = array('B', [r.offset for r in regs])
+
+    def _compile_cache_policy(self):
+        """
+        Works out how long each address stays fresh: the shortest time of its
+        registers, and not cached at all if any are volatile.
+        """
+        self._addr_ttl = {}
+        self._read_times = {}
+        for addr, regs in self._addr_to_regs.items():
+            ttl = _address_ttl(regs)
+            if ttl is not None:
+                self._addr_ttl[addr] = ttl
+
+    def invalidate_cache(self, registers=None):
+        """
+        Forgets when ``registers`` (or all registers, if None) were last read,
+        so the next `read_state` reads them from the device.
+        """
+        if registers is None:
+            self._read_times.clear()
+        else:
+            if isinstance(registers, (RegisterValue, MultiRegisterValue)):
+                registers = [registers]
+            for addr in self._addresses_of(registers):
+                self._read_times.pop(addr, None)
 
     def get_register(self, name):
         if name in self._name_to_multireg:
@@ -155,116 +706,503 @@ class RegisterState(ABC):
     def register_size(self):
         return self._register_size
 
-    def _read_raw(self, registers, groupread):
+    @property
+    def threadsafe(self):
+        """
+        Whether reads and writes lock the addresses they touch, so that
+        several threads can share this state.
+        """
+        return self._threadsafe
+
+    def _locked(self, addrs, bus=True):
+        """
+        A context manager holding the locks of the addresses ``addrs`` if this
+        state is thread-safe, and doing nothing otherwise.
+
+        If ``bus`` is True the bus lock (if the backend has one) is taken
+        first, which is the order `BusManager.batch` takes them in.  Only pass
+        False if nothing in the block goes over the bus.
+        """
+        if self._addr_locks is None:
+            return _NULL_CONTEXT
+        return self._hold_locks(addrs, bus)
+
+    @contextmanager
+    def _hold_locks(self, addrs, bus=True):
+        # always acquire the bus lock and then the address locks in address
+        # order, so two threads can't deadlock
+        locks = [self._addr_locks[addr] for addr in sorted(set(addrs))
+                 if addr in self._addr_locks]
+        if bus and self._bus_lock is not None:
+            locks.insert(0, self._bus_lock)
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def snapshot(self, registers=None):
+        """
+        Returns a dictionary mapping names to the current (local) values of
+        ``registers`` (or all registers if None), taken all at once even if
+        other threads are reading or writing a thread-safe state.
+        """
         if registers is None:
-            addrs = self._addr_to_regs.keys()
+            registers = list(self._name_to_reg.values())
+            registers.extend(self._name_to_multireg.values())
         else:
-            addrs = sorted(set([reg.address for reg in registers]))
-        if groupread:
+            registers = [self.get_register(r) if isinstance(r, str) else r
+                         for r in registers]
+
+        with self._locked(self._addresses_of(registers), bus=False):
+            return {r.name: r.value for r in registers}
+
+    @property
+    def word_bytes(self):
+        """
+        The number of bytes each register word takes on the bus.
+        """
+        return self._word_bytes
+
+    def _unpack_words(self, buf):
+        """
+        Converts the bytes in ``buf`` (bytes-like or a list of ints) to a list
+        of words of `word_bytes` bytes each, in `byteorder`.
+        """
+        wb = self._word_bytes
+        if wb == 1:
+            return list(buf)
+
+        buf = bytes(buf)
+        code = _STRUCT_CODES.get(wb)
+        if code is None:
+            return [int.from_bytes(buf[i:i + wb], self.byteorder)
+                    for i in range(0, len(buf), wb)]
+        fmt = '{}{}{}'.format('>' if self.byteorder == 'big' else '<',
+                              len(buf) // wb, code)
+        return list(struct.unpack(fmt, buf))
+
+    def _pack_words(self, words):
+        """
+        The inverse of `_unpack_words`: returns the bytes of ``words``.
+        """
+        wb = self._word_bytes
+        if wb == 1:
+            return bytes(words)
+
+        code = _STRUCT_CODES.get(wb)
+        if code is None:
+            return b''.join(w.to_bytes(wb, self.byteorder) for w in words)
+        fmt = '{}{}{}'.format('>' if self.byteorder == 'big' else '<',
+                              len(words), code)
+        return struct.pack(fmt, *words)
+
+    @property
+    def bus_key(self):
+        """
+        A hashable identifying the bus this state is on.  States with the same
+        key share an executor for the ``*_async`` methods, so their
+        transactions are kept in order.  A state that isn't on a shared bus
+        gets a key of its own, and its executor is shut down when the state is
+        closed or garbage collected.
+        """
+        if self._bus_key is not None:
+            return self._bus_key
+
+        finalizer = self._executor_finalizer
+        if finalizer is None or not finalizer.alive:
+            self._own_bus_key = ('state', next(_state_ids))
+            self._executor_finalizer = weakref.finalize(
+                self, release_bus_executor, self._own_bus_key)
+        return self._own_bus_key
+
+    def close(self):
+        """
+        Releases anything the state holds on to.  Subclasses with resources
+        of their own should extend this.
+        """
+        if self._executor_finalizer is not None:
+            self._executor_finalizer()
+
+    def _addresses_of(self, registers):
+        """
+        Returns the sorted, unique addresses covered by ``registers`` (or all
+        addresses if None), expanding any MultiRegisterValue's.
+        """
+        if registers is None:
+            return sorted(self._addr_to_regs.keys())
+
+        addrs = set()
+        for reg in registers:
+            if isinstance(reg, MultiRegisterValue):
+                addrs.update(r.address for r in reg.registers)
+            else:
+                addrs.add(reg.address)
+        return sorted(addrs)
+
+    def instrument(self, stats=True, callback=None, address_bin=16):
+        """
+        Starts recording the bus transactions of this state.  Until this is
+        called, there is no instrumentation overhead at all.
+
+        Parameters
+        ----------
+        stats : bool or TransactionStats
+            If True, accumulate into a new `TransactionStats`, if a
+            `TransactionStats`, accumulate into that, and if False, don't.
+        callback : callable or None
+            Called with a `Transaction` after each bus transaction.
+        address_bin : int
+            Width of the address ranges used by a new `TransactionStats`.
+
+        Returns
+        -------
+        stats : TransactionStats or None
+        """
+        self.uninstrument()
+        if stats is True:
+            stats = TransactionStats(address_bin)
+        elif stats is False:
+            stats = None
+        self._stats = stats
+        _instrument(self, stats, callback)
+        return stats
+
+    def uninstrument(self):
+        """
+        Stops recording bus transactions.
+        """
+        self.__dict__.pop('_read_register', None)
+        self.__dict__.pop('_read_into', None)
+        self.__dict__.pop('_write_register', None)
+        self._stats = None
+
+    @property
+    def stats(self):
+        """
+        The `TransactionStats` being recorded by `instrument`, or None.
+        """
+        return self._stats
+
+    def _read_addresses_cached(self, addrs, groupread):
+        """
+        Like `_read_addresses`, but addresses that are still fresh according to
+        their cache policy are taken from the last words read instead of the
+        device.
+        """
+        if not self._addr_ttl:
+            return self._read_addresses(addrs, groupread)
+
+        addr_ttl = self._addr_ttl
+        read_times = self._read_times
+        now = time.monotonic()
+        cached = {}
+        stale = []
+        for addr in addrs:
+            ttl = addr_ttl.get(addr)
+            if ttl is not None and now - read_times.get(addr, -ttl) < ttl:
+                cached[addr] = self._raw_words[addr]
+            else:
+                stale.append(addr)
+
+        raw_values = self._read_addresses(stale, groupread) if stale else {}
+        for addr in raw_values:
+            if addr in addr_ttl:
+                read_times[addr] = now
+        raw_values.update(cached)
+        return raw_values
+
+    def _read_addresses(self, addrs, groupread):
+        if groupread == 'auto':
+            raw_values = {}
+            for start, n in self._plan_read_bursts(addrs):
+                if n == 1:
+                    raw_values[start] = self._read_register(start)
+                else:
+                    vals = self._read_register(start, ntimes=n)
+                    raw_values.update({(start + i): v for i, v in enumerate(vals)})
+            return raw_values
+        elif groupread:
             minaddr = min(addrs)
             vals = self._read_register(minaddr, ntimes=max(addrs) - minaddr + 1)
             return {(minaddr + i): v for i, v in enumerate(vals)}
         else:
             return {addr: self._read_register(addr) for addr in addrs}
 
-    def read_state(self, registers=None, groupread='multi', update_all=True):
+    def _plan_read_bursts(self, addrs):
+        """
+        Splits the sorted addresses ``addrs`` into ``(start_address, length)``
+        bursts, reading through gaps when that is cheaper than starting a new
+        transaction according to `_transaction_cost` and `_byte_cost`.
+        """
+        word_cost = self._byte_cost * self._word_bytes
+        return _cached_plan_bursts(tuple(addrs), self._transaction_cost,
+                                   word_cost, self._max_block_size)
+
+    def _plan_for(self, addrs, groupread):
+        """
+        The ``(start_address, length)`` bursts for reading the sorted addresses
+        ``addrs`` with ``groupread`` True, False, or 'auto'.
+        """
+        if groupread == 'auto':
+            return self._plan_read_bursts(addrs)
+        elif groupread:
+            return [(addrs[0], addrs[-1] - addrs[0] + 1)]
+        else:
+            return [(addr, 1) for addr in addrs]
+
+    def burst_buffer(self, registers=None, groupread='auto'):
+        """
+        Returns a `BurstBuffer` for repeatedly reading ``registers`` (or all
+        registers if None).  ``groupread`` is True, False, or 'auto', as in
+        `read_state`.
+        """
+        if isinstance(registers, (RegisterValue, MultiRegisterValue)):
+            registers = [registers]
+        elif registers is not None:
+            registers = [self.get_register(r) if isinstance(r, str) else r
+                         for r in registers]
+
+        plan = self._plan_for(self._addresses_of(registers), groupread)
+        return BurstBuffer(self, plan)
+
+    def read_state(self, registers=None, groupread='multi', update_all=True,
+                   use_cache=True):
         """
         Updates the state from the device.  If ```registers` is None, update all
         registers, otherwise should be a list of registers, and only addresses
         from that register will be.
 
         If ``groupread`` is True, lump the reads into one call.  If 'multi',
-        only group the reads that are MultiRegisterValue's.
+        only group the reads that are MultiRegisterValue's.  If 'auto', split
+        the addresses into bursts using the backend's cost model (see
+        `_plan_read_bursts`).
 
         If ``update_all`` is True, this updates everything that was read even if
         it wasn't specifically asked for.  If False, only ``registers`` are
         updated.
+
+        If ``use_cache`` is True, addresses whose registers are all still fresh
+        according to their ``cache`` policy are not read again.
+        """
+        return self.prepare_read(registers, groupread, update_all,
+                                 use_cache).execute()
+
+    def prepare_read(self, registers=None, groupread='multi', update_all=True,
+                     use_cache=True):
+        """
+        Returns a `ReadRequest` that does the same as
+        ``read_state(registers, groupread, update_all, use_cache)`` each time it
+        is executed, without sorting out the registers again every time.
         """
         if registers is None:
             registers = list(self._name_to_reg.values())
             registers.extend(self._name_to_multireg.values())
         elif isinstance(registers, (RegisterValue, MultiRegisterValue)):
             registers = [registers]
-        else:
-            registers = list(registers)
-
-        # convert any MultiRegisterValue's to their constituent registers
-        multi_subregisters = []
-        mr_idxs = [i for i, r in enumerate(registers)
-                   if isinstance(r, MultiRegisterValue)]
-        for i in mr_idxs[::-1]:
-            mr = registers.pop(i)
-            multi_subregisters.append(mr.registers)
-        for reg in multi_subregisters:
-            if reg in registers:
-                registers.remove(reg)
-
-        if groupread == 'multi':
-            # first all those that are *not* multiregs
-            raw_values = self.read_state(registers=registers, groupread=False,
-                                         update_all=update_all)
-
-            #now the multis
-            for regset in multi_subregisters:
-                raw_values.update(self.read_state(regset, groupread=True,
-                                                  update_all=update_all))
-        else:
-            for regset in multi_subregisters:
-                registers.extend(regset)
-            raw_values = self._read_raw(registers, groupread)
-            r2c = None if update_all else registers
-            for addr, rawval in raw_values.items():
-                self._update_state_by_register(addr, rawval, regs_to_check=r2c)
-        return raw_values
+        return ReadRequest(self, registers, groupread, update_all, use_cache)
 
     def _update_state_by_register(self, addr, val, skip_writeable=False,
                                   regs_to_check=None):
         """
-        regs_to_check of None means check everything, otherwise it's a list of
+        regs_to_check of None means check everything, otherwise it's a set of
         register objects.
         """
-        for regv in self._addr_to_regs[addr]:
+        self._raw_words[addr] = val
+        ai = self._addr_index.get(addr)
+        if ai is None:
+            # grouped reads can include addresses with no registers
+            return
+
+        fregs = self._field_regs
+        masks = self._field_masks
+        shifts = self._field_shifts
+        for fi in range(self._field_starts[ai], self._field_starts[ai + 1]):
+            regv = fregs[fi]
             if skip_writeable and regv.writeable:
                 continue
             if regs_to_check is not None and regv not in regs_to_check:
                 continue
-            regv.value = (val & regv.bitmask) >> regv.offset
+            # set the private attributes so this doesn't count as a local change
+            regv._value = (val & masks[fi]) >> shifts[fi]
+            regv._dirty = False
+
+        if addr in self._dirty_addrs:
+            if not any(r._dirty for r in self._addr_to_regs[addr]):
+                self._dirty_addrs.discard(addr)
 
     def write_state(self, registers=None, only_update=True):
+        """
+        Writes the state to the device.  If ``registers`` is None, write all
+        registers, otherwise only the addresses of ``registers``.
+
+        If ``only_update`` is True, the current words are read first, the new
+        values are merged into them, and only the words that changed are
+        written.  Each word is built once, and words at contiguous addresses
+        are sent as block writes if `block_writes` is True.
+        """
         if isinstance(registers, (RegisterValue, MultiRegisterValue)):
             registers = [registers]
 
-        if registers is None:
-            addrs = self._addr_to_regs.keys()
-        else:
-            addrs = [reg.address for reg in registers]
+        addrs = self._addresses_of(registers)
+        with self._locked(addrs):
+            self._write_state(registers, addrs, only_update)
 
+    def _write_state(self, registers, addrs, only_update):
         raw_values = None
         if only_update:
-            raw_values = self._read_raw(registers, False)
+            raw_values = self._read_addresses(addrs, False)
 
         # for each address, build the expected value from the corresponding registers
+        to_write = {}
+        read_back = []
+        for addr in addrs:
+            oldval = raw_values[addr] if only_update else 0
+            newval, needs_read_back = self._build_word(addr, oldval)
+            if newval is not None and (not only_update or newval != oldval):
+                to_write[addr] = newval
+            if needs_read_back:
+                read_back.append(addr)
+
+        self._write_words(to_write)
+        self._clear_dirty(addrs)
+        if only_update and self._stats is not None:
+            self._stats.read_modify_writes += len(to_write)
+
+        for addr in read_back:
+            rval = self._read_register(addr)
+            self._update_state_by_register(addr, rval, skip_writeable=True)
+
+    def _build_word(self, addr, val):
+        """
+        Merges the values of the registers at ``addr`` into the word ``val``.
+        Returns the new word (or None if no register contributed to it) and
+        whether the word needs to be read back after writing.
+        """
+        newval = None
+        read_back = False
+        for regv in self._addr_to_regs[addr]:
+            if regv.value is None:
+                continue
+            if regv.writeable is None:
+                read_back = True
+            elif not regv.writeable:
+                continue
+
+            if newval is None:
+                newval = val
+            # set everything at the bitmask to 0
+            newval &= ~regv.bitmask&(2**self._register_size - 1)
+            if regv.value != 0:
+                newval |= regv.value << regv.offset
+        return newval, read_back
+
+    @property
+    def dirty_addresses(self):
+        """
+        The sorted addresses that have registers set locally but not yet
+        written to the device.
+        """
+        # copy first, since other threads can be setting registers
+        return tuple(sorted(self._dirty_addrs.copy()))
+
+    def flush(self):
+        """
+        Writes only the words with registers that have changed since they were
+        last read or written.  The current word is only read from the device
+        first if it cannot be built locally: i.e., if any register in it is
+        unknown or not writeable, or if the registers don't cover the whole
+        word and it has not been seen before.
+
+        Returns the addresses that were written.
+        """
+        # copy first, since other threads can be setting registers
+        addrs = sorted(self._dirty_addrs.copy())
+        if not addrs:
+            return ()
+
+        with self._locked(addrs):
+            return self._flush(addrs)
+
+    def _flush(self, addrs):
+        base_words = {}
+        to_read = []
+        for addr in addrs:
+            base = self._local_word_base(addr)
+            if base is None:
+                to_read.append(addr)
+            else:
+                base_words[addr] = base
+        if to_read:
+            pre_read = self._read_addresses(to_read, 'auto')
+            # only keep the words at the locked addresses, not any read
+            # through in gaps
+            for addr in to_read:
+                self._raw_words[addr] = base_words[addr] = pre_read[addr]
+
+        to_write = {}
+        read_back = []
+        for addr in addrs:
+            newval, needs_read_back = self._build_word(addr, base_words[addr])
+            if newval is not None and newval != self._raw_words.get(addr):
+                to_write[addr] = newval
+            if needs_read_back:
+                read_back.append(addr)
+
+        self._write_words(to_write)
+        self._clear_dirty(addrs)
+        if self._stats is not None:
+            self._stats.read_modify_writes += len(set(to_read).intersection(to_write))
+
+        for addr in read_back:
+            rval = self._read_register(addr)
+            self._update_state_by_register(addr, rval, skip_writeable=True)
+
+        return tuple(sorted(to_write))
+
+    def _local_word_base(self, addr):
+        """
+        Returns the word to build ``addr`` on top of without reading the
+        device, or None if it has to be read.
+        """
+        bits_set = 0
+        for regv in self._addr_to_regs[addr]:
+            if regv.value is None or regv.writeable is not True:
+                return None
+            bits_set |= regv.bitmask
+
+        if bits_set == 2**self._register_size - 1:
+            return 0
+        else:
+            return self._raw_words.get(addr)
+
+    def _clear_dirty(self, addrs):
         for addr in addrs:
-            newval = raw_values[addr] if only_update else 0
-            read_back = False
             for regv in self._addr_to_regs[addr]:
-                if regv.value is None:
-                    continue
-                if regv.writeable is None:
-                    read_back = True
-                elif not regv.writeable:
-                    continue
-
-                # set everythink at the bitmask to 0
-                newval &= ~regv.bitmask&(2**self._register_size - 1)
-                if regv.value != 0:
-                    newval |= regv.value << regv.offset
-
-                if not only_update or newval != raw_values[addr]:
-                    self._write_register(addr, newval)
-            if read_back:
-                rval = self._read_register(addr)
-                self._update_state_by_register(addr, rval, skip_writeable=True)
+                regv._dirty = False
+            self._dirty_addrs.discard(addr)
+
+    def _write_words(self, words):
+        """
+        Writes a dictionary mapping address to word, grouping contiguous
+        addresses into block writes where the backend allows it.
+        """
+        if self.block_writes:
+            runs = _plan_runs(sorted(words), self._max_block_size)
+        else:
+            runs = [(addr, 1) for addr in sorted(words)]
+
+        for start, n in runs:
+            if n == 1:
+                self._write_register(start, words[start])
+            else:
+                self._write_register(start, [words[start + i] for i in range(n)])
+        self._raw_words.update(words)
+        # the device may not have taken the words as written, so read again
+        for addr in words:
+            self._read_times.pop(addr, None)
 
     def set_and_write_register(self, regorname, newvalue, **kwargs):
         """
@@ -277,10 +1215,33 @@ class RegisterState(ABC):
         else:
             reg = self.get_register(regorname)
 
-        reg.value = newvalue
-        self.write_state(reg, **kwargs)
+        with self._locked((reg.address,)):
+            reg.value = newvalue
+            self.write_state(reg, **kwargs)
 
-        return reg.value
+            return reg.value
+
+    async def read_state_async(self, *args, **kwargs):
+        """
+        Like `read_state`, but runs on this state's bus executor without
+        blocking the event loop.
+        """
+        return await run_on_bus(self.bus_key, self.read_state, *args, **kwargs)
+
+    async def write_state_async(self, *args, **kwargs):
+        """
+        Like `write_state`, but runs on this state's bus executor without
+        blocking the event loop.
+        """
+        return await run_on_bus(self.bus_key, self.write_state, *args, **kwargs)
+
+    async def set_and_write_register_async(self, *args, **kwargs):
+        """
+        Like `set_and_write_register`, but runs on this state's bus executor
+        without blocking the event loop.
+        """
+        return await run_on_bus(self.bus_key, self.set_and_write_register,
+                                *args, **kwargs)
 
     @abstractmethod
     def _read_register(self, address, ntimes=None):
@@ -290,10 +1251,26 @@ class RegisterState(ABC):
         """
         raise NotImplementedError
 
+    def _read_into(self, address, buf):
+        """
+        Reads ``len(buf)`` words starting at ``address`` into the writeable
+        buffer ``buf`` (e.g. a `memoryview` of an `array.array`).  Backends
+        that can fill the buffer without building a list should override this.
+        Overrides that fall back to reading a list should use
+        `_read_words_into` with the class's ``_read_register``, since when
+        instrumented both the override and the instance's ``_read_register``
+        are wrapped, and the burst would be recorded twice.
+        """
+        _read_words_into(self._read_register, address, buf)
+
     @abstractmethod
     def _write_register(self, address, value):
         """
         Writes to a register.  ``value`` could be a list, which means write in a
         single operation
+
+        For words wider than 8 bits, each word is `word_bytes` bytes on the bus
+        (in `byteorder`), and a burst of ``n`` words moves ``n * word_bytes``
+        bytes.
         """
         raise NotImplementedError
@@ -0,0 +1,299 @@
+"""
+Register maps described declaratively (in JSON, TOML, YAML, or a plain
+dictionary), compiled once into an immutable `RegisterMap` that any number of
+`RegisterState`'s can share.
+
+A map file looks like (in JSON)::
+
+    {"register_size": 8,
+     "registers": [
+        {"name": "id", "address": "0xD0", "nbits": 8, "writeable": false,
+         "cache": "constant"},
+        {"name": "temp_lsb", "address": 251, "nbits": 8},
+        {"name": "temp_msb", "address": 250, "nbits": 8}],
+     "multiregisters": [
+        {"name": "temp", "registers": ["temp_lsb", "temp_msb"]}]}
+
+``registers`` and ``multiregisters`` can also be tables keyed by name, which
+reads more naturally in TOML.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+from array import array
+from collections import OrderedDict
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from .register_state import (RegisterValue, MultiRegisterValue, _check_word,
+                             _address_ttl)
+
+__all__ = ['RegisterMap', 'load_register_map']
+
+# bump when the pickled form of RegisterMap changes
+_CACHE_VERSION = 2
+
+_FIELD_KEYS = ('name', 'address', 'offset', 'nbits', 'description',
+               'writeable', 'cache')
+
+
+class RegisterMap:
+    """
+    A validated, compiled register map.  Pass it to a `RegisterState` in
+    place of a list of registers and the state skips copying and
+    re-validating the registers, and shares the decoding tables with every
+    other state made from the same map.
+
+    Don't make these directly, use `from_registers`, `from_dict`, or
+    `load_register_map`.  A map is never changed once made.
+
+    Attributes
+    ----------
+    register_size : int
+        The word size the map was validated for.
+    fields : tuple
+        ``(name, address, offset, nbits, description, writeable, cache)`` for
+        each register, in the order they were given.
+    multiregisters : tuple
+        ``(name, field_indices, description)`` for each multi-register.
+    """
+    def __init__(self, fields, multiregisters, register_size=8):
+        self.register_size = register_size
+        self.fields = tuple(tuple(f) for f in fields)
+        self.multiregisters = tuple((nm, tuple(idxs), desc)
+                                    for nm, idxs, desc in multiregisters)
+        self._compile()
+
+    def _compile(self):
+        # validate with throwaway RegisterValue's, so the checks are exactly
+        # the same as RegisterState's
+        regs = [RegisterValue(*f) for f in self.fields]
+        multis = _make_multis(regs, self.multiregisters)
+        byname = {}
+        for r in regs:
+            if r.name in byname:
+                raise ValueError('Register name {} is used more than '
+                                 'once'.format(r.name))
+            byname[r.name] = r
+
+        by_addr = {}
+        for i, f in enumerate(self.fields):
+            by_addr.setdefault(f[1], []).append(i)
+        addrs = sorted(by_addr)
+        order = []
+        ttls = {}
+        for addr in addrs:
+            idxs = sorted(by_addr[addr], key=lambda i: self.fields[i][2])
+            _check_word(addr, [regs[i] for i in idxs], self.register_size)
+            ttl = _address_ttl([regs[i] for i in idxs])
+            if ttl is not None:
+                ttls[addr] = ttl
+            order.extend(idxs)
+
+        self.field_order = tuple(order)
+        self.decode_addrs = array('l', addrs)
+        self.addr_index = {addr: i for i, addr in enumerate(addrs)}
+        starts = [0]
+        for addr in addrs:
+            starts.append(starts[-1] + len(by_addr[addr]))
+        self.field_starts = array('l', starts)
+
+        masks = [regs[i].bitmask for i in order]
+        self.field_masks = (masks if self.register_size > 64
+                            else array('Q', masks))
+        self.field_shifts = array('B', [regs[i].offset for i in order])
+        self.addr_ttl = ttls
+        # (bitmask, limit) for each field, so states don't recompute them
+        self.field_limits = tuple((r.bitmask, 2**r.nbits) for r in regs)
+        self.multi_shifts = tuple(mr._shifts for mr in multis)
+
+    def registers(self):
+        """
+        Returns new `RegisterValue` and `MultiRegisterValue` objects for the
+        map, e.g. for code that expects a list of registers.
+        """
+        regs = [RegisterValue(*f) for f in self.fields]
+        return regs + _make_multis(regs, self.multiregisters)
+
+    @property
+    def names(self):
+        return [f[0] for f in self.fields] + [mr[0] for mr in self.multiregisters]
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return '<RegisterMap {} registers, {} multi-registers, {} bits>'.format(
+            len(self.fields), len(self.multiregisters), self.register_size)
+
+    @classmethod
+    def from_registers(cls, registers, register_size=8):
+        """
+        Compiles a map from a list of `RegisterValue`'s and
+        `MultiRegisterValue`'s, like those given to `RegisterState`.
+        """
+        fields = []
+        index = {}
+        multis = []
+        for r in registers:
+            if isinstance(r, MultiRegisterValue):
+                multis.append(r)
+            else:
+                index[r.name] = len(fields)
+                fields.append((r.name, r.address, r.offset, r.nbits,
+                               r.description, r.writeable, r.cache))
+        multiregisters = [(mr.name, [index[r.name] for r in mr.registers],
+                           mr.description) for mr in multis]
+        return cls(fields, multiregisters, register_size)
+
+    @classmethod
+    def from_dict(cls, d):
+        """
+        Compiles a map from a dictionary as described in the module
+        docstring.
+        """
+        registers = d.get('registers', [])
+        if isinstance(registers, dict):
+            registers = [dict(spec, name=name) for name, spec in registers.items()]
+        fields = []
+        index = {}
+        for spec in registers:
+            unknown = set(spec) - set(_FIELD_KEYS)
+            if unknown:
+                raise ValueError('Unknown keys {} for register '
+                                 '{}'.format(sorted(unknown), spec.get('name')))
+            address = spec['address']
+            if isinstance(address, str):
+                address = int(address, 0)
+            index[spec['name']] = len(fields)
+            fields.append((spec['name'], address, spec.get('offset', 0),
+                           spec.get('nbits', 1), spec.get('description', ''),
+                           spec.get('writeable'), spec.get('cache')))
+
+        multis = d.get('multiregisters', [])
+        if isinstance(multis, dict):
+            multis = [dict(spec, name=name) if isinstance(spec, dict)
+                      else {'name': name, 'registers': spec}
+                      for name, spec in multis.items()]
+        multiregisters = []
+        for spec in multis:
+            try:
+                idxs = [index[nm] for nm in spec['registers']]
+            except KeyError as e:
+                raise ValueError('Multi-register {} refers to unknown register '
+                                 '{}'.format(spec['name'], e.args[0]))
+            multiregisters.append((spec['name'], idxs,
+                                   spec.get('description', '')))
+
+        return cls(fields, multiregisters, d.get('register_size', 8))
+
+    def to_dict(self):
+        """
+        The inverse of `from_dict`, e.g. for writing out a map first made in
+        Python.
+        """
+        registers = [OrderedDict(zip(_FIELD_KEYS, f)) for f in self.fields]
+        multis = [OrderedDict([('name', nm),
+                               ('registers', [self.fields[i][0] for i in idxs]),
+                               ('description', desc)])
+                  for nm, idxs, desc in self.multiregisters]
+        return OrderedDict([('register_size', self.register_size),
+                            ('registers', registers),
+                            ('multiregisters', multis)])
+
+
+def _make_multis(regs, multiregisters):
+    return [MultiRegisterValue(nm, [regs[i] for i in idxs], desc)
+            for nm, idxs, desc in multiregisters]
+
+
+def _parse(data, fmt):
+    if fmt == 'json':
+        return json.loads(data.decode('utf-8'))
+    elif fmt == 'toml':
+        if tomllib is None:
+            raise ImportError('tomllib/tomli not present, cannot load TOML '
+                              'register maps')
+        return tomllib.loads(data.decode('utf-8'))
+    elif fmt == 'yaml':
+        if yaml is None:
+            raise ImportError('PyYAML not present, cannot load YAML register maps')
+        return yaml.safe_load(data)
+    else:
+        raise ValueError('Unrecognized register map format {!r}'.format(fmt))
+
+
+_EXTENSIONS = {'.json': 'json', '.toml': 'toml', '.yaml': 'yaml', '.yml': 'yaml'}
+
+
+def load_register_map(fn, format=None, cache=True, cache_dir=None):
+    """
+    Loads a `RegisterMap` from a JSON, TOML, or YAML file.
+
+    The compiled map is pickled into ``cache_dir`` (by default a
+    ``__pycache__`` directory next to ``fn``), keyed by a hash of the file's
+    contents, so later loads of an unchanged file skip parsing and
+    validation.  If the cache can't be written, the map is just not cached.
+
+    Parameters
+    ----------
+    fn : str
+        The file to load.
+    format : 'json', 'toml', 'yaml', or None
+        The format of the file, if None taken from the extension.
+    cache : bool
+        Whether to use the on-disk cache.
+    cache_dir : str or None
+        Where to keep the cache.
+    """
+    if format is None:
+        ext = os.path.splitext(fn)[1].lower()
+        if ext not in _EXTENSIONS:
+            raise ValueError('Cannot tell the format of {} from its extension, '
+                             'give format='.format(fn))
+        format = _EXTENSIONS[ext]
+
+    with open(fn, 'rb') as f:
+        data = f.read()
+    if not cache:
+        return RegisterMap.from_dict(_parse(data, format))
+
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(fn)),
+                                 '__pycache__')
+    cache_fn = os.path.join(cache_dir, '{}.{}.regmap-{}.pickle'.format(
+        os.path.basename(fn), digest, _CACHE_VERSION))
+
+    try:
+        with open(cache_fn, 'rb') as f:
+            regmap = pickle.load(f)
+        if isinstance(regmap, RegisterMap):
+            return regmap
+    except Exception:
+        # missing, stale or unreadable, so compile it again
+        pass
+
+    regmap = RegisterMap.from_dict(_parse(data, format))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmpfn = '{}.{}'.format(cache_fn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+            pickle.dump(regmap, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfn, cache_fn)
+    except OSError:
+        pass
+    return regmap
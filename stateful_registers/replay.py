@@ -0,0 +1,279 @@
+"""
+Recording the bus transactions of a live `RegisterState`, and replaying them
+later without the hardware.
+"""
+import json
+
+from .instrumentation import Transaction
+from .register_state import RegisterState
+from .timing import _spin_wait
+
+__all__ = ['TransactionLog', 'ReplayRegisterState']
+
+# the attributes of the recorded state that decide which transactions a read
+# or write makes, so a replay can make the same ones
+_PLANNER_SETTINGS = ('register_size', '_transaction_cost', '_byte_cost',
+                     '_max_block_size', 'block_writes')
+
+
+def _plain(value):
+    # results can be array slices or tuples, which json doesn't know about
+    if value is None or isinstance(value, int):
+        return value
+    return [int(v) for v in value]
+
+
+class TransactionLog:
+    """
+    A sequence of `Transaction`'s, which can be recorded from a live state,
+    saved to and loaded from a file of JSON lines, and replayed by
+    `ReplayRegisterState`.
+
+    Attributes
+    ----------
+    settings : dict
+        The recorded state's register size and burst planning settings
+        (``_transaction_cost``, ``_byte_cost``, ``_max_block_size``, and
+        ``block_writes``), applied by `ReplayRegisterState`.
+
+    Examples
+    --------
+    ::
+
+        log = TransactionLog.record(state)
+        poll(state)
+        state.uninstrument()
+        log.save('session.jsonl')
+    """
+    def __init__(self, transactions=(), settings=None):
+        self.transactions = [Transaction(*t) for t in transactions]
+        self.settings = dict(settings or {})
+
+    @classmethod
+    def record(cls, state, stats=False):
+        """
+        Starts recording the transactions of ``state`` (using
+        `RegisterState.instrument`) into a new log, and returns it.  Stop
+        with ``state.uninstrument()``.  ``stats`` is passed on to
+        `RegisterState.instrument`.
+        """
+        log = cls(settings={nm: getattr(state, nm) for nm in _PLANNER_SETTINGS})
+        state.instrument(stats=stats, callback=log.append)
+        return log
+
+    def append(self, transaction):
+        self.transactions.append(transaction)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(self.transactions)
+
+    def __getitem__(self, i):
+        return self.transactions[i]
+
+    @property
+    def duration(self):
+        """
+        Seconds from the start of the first transaction to the end of the
+        last.
+        """
+        if not self.transactions:
+            return 0.
+        last = self.transactions[-1]
+        return last.start + last.duration - self.transactions[0].start
+
+    def save(self, fn):
+        """
+        Writes the log to ``fn`` as one JSON object per line, after a first
+        line holding `settings`.
+        """
+        with open(fn, 'w') as f:
+            f.write(json.dumps({'settings': self.settings}))
+            f.write('\n')
+            for t in self.transactions:
+                row = t._asdict()
+                row['argument'] = _plain(t.argument)
+                row['result'] = _plain(t.result)
+                f.write(json.dumps(row))
+                f.write('\n')
+
+    @classmethod
+    def load(cls, fn):
+        """
+        Reads a log written by `save`.
+        """
+        transactions = []
+        settings = None
+        with open(fn, 'r') as f:
+            for l in f:
+                if not l.strip():
+                    continue
+                row = json.loads(l)
+                if 'settings' in row:
+                    settings = row['settings']
+                else:
+                    transactions.append(Transaction(**row))
+        return cls(transactions, settings)
+
+
+class ReplayRegisterState(RegisterState):
+    """
+    A `RegisterState` that answers reads from a `TransactionLog` recorded
+    from a real device, for profiling polling code without the hardware.
+
+    Parameters
+    ----------
+    log : TransactionLog or str
+        The log, or a file to load it from.
+    realtime : bool
+        If True, each transaction takes as long as it did when it was recorded
+        (divided by ``speed``).  Only the bus time is reproduced: the time
+        between transactions is whatever the code being replayed takes.  If
+        False, replay as fast as possible.
+    speed : float
+        How many times faster than recorded to run when ``realtime`` is True.
+    strict : bool
+        If True, the transactions must be exactly the ones recorded, in the
+        same order, and anything else raises a ValueError.  If False, the log
+        is treated as a record of the device's contents over time, so code
+        that reads differently from the recorded code (e.g. one address at a
+        time instead of in bursts) can still be replayed.  Reads are answered
+        with the most recent recorded words at the addresses asked for (or the
+        first recorded, for addresses not read yet).  Reading an address again
+        moves the replay on past the next recorded read of any of the
+        addresses asked for, and once the log is used up the last recorded
+        words keep being returned.
+    register_size : int or None
+        The word size, or None to use the one in the log's `settings` (or 8
+        if it has none).
+    transaction_cost, byte_cost, max_block_size, block_writes
+        Override the burst planning settings recorded in the log.  By default
+        they are the recorded state's, so that reads and writes are split into
+        the same transactions as when recording.
+    """
+    def __init__(self, registers, log, realtime=False, speed=1., strict=True,
+                 register_size=None, threadsafe=False, byteorder='big',
+                 transaction_cost=None, byte_cost=None, max_block_size=None,
+                 block_writes=None):
+        if not isinstance(log, TransactionLog):
+            log = TransactionLog.load(log)
+        settings = log.settings
+        if register_size is None:
+            register_size = settings.get('register_size', 8)
+        super().__init__(registers, register_size, threadsafe, byteorder)
+
+        overrides = {'_transaction_cost': transaction_cost,
+                     '_byte_cost': byte_cost,
+                     '_max_block_size': max_block_size,
+                     'block_writes': block_writes}
+        for nm, value in overrides.items():
+            if value is None:
+                value = settings.get(nm)
+            if value is not None:
+                setattr(self, nm, value)
+
+        self.log = log
+        self.realtime = realtime
+        self.speed = speed
+        self.strict = strict
+        self.rewind()
+
+    def rewind(self):
+        """
+        Starts the replay over from the beginning of the log.
+        """
+        self.position = 0
+        self.replayed_time = 0.
+        # addresses read since the non-strict replay last moved on, or None
+        # if it has to move on to the first read
+        self._served = None
+
+        # the first word recorded at each address, for non-strict replays
+        self._image = {}
+        for t in reversed(self.log.transactions):
+            if t.kind == 'read':
+                self._apply(self._image, t)
+
+    @property
+    def remaining(self):
+        """
+        The number of transactions left in the log.
+        """
+        return len(self.log) - self.position
+
+    def _apply(self, image, transaction):
+        if transaction.kind == 'read':
+            words = transaction.result
+        else:
+            words = transaction.argument
+        if isinstance(words, int):
+            image[transaction.address] = words
+        else:
+            for i, word in enumerate(words):
+                image[transaction.address + i] = word
+
+    def _wait(self, duration):
+        self.replayed_time += duration
+        if self.realtime and duration > 0:
+            _spin_wait(duration/self.speed)
+
+    def _next(self, kind, address, argument):
+        # the next transaction of a strict replay, which must be this one
+        if self.position >= len(self.log):
+            raise EOFError('Replay log exhausted after {} '
+                           'transactions'.format(len(self.log)))
+
+        t = self.log[self.position]
+        if (t.kind, t.address, _plain(t.argument)) != (kind, address, _plain(argument)):
+            raise ValueError('Replay diverged from the log at transaction {}: '
+                             'expected {} at {} ({}), got {} at {} '
+                             '({})'.format(self.position, t.kind, t.address,
+                                           t.argument, kind, address, argument))
+        self.position += 1
+        self._wait(t.duration)
+        return t
+
+    def _advance(self, addrs):
+        # move on past the next recorded read of any of addrs, keeping track
+        # of what's been seen on the way
+        duration = 0.
+        while self.position < len(self.log):
+            t = self.log[self.position]
+            self.position += 1
+            self._apply(self._image, t)
+            if t.kind == 'read':
+                n = 1 if t.argument is None else t.argument
+                if any(t.address <= addr < t.address + n for addr in addrs):
+                    duration = t.duration
+                    break
+        self._served = set()
+        self._wait(duration)
+
+    def _read_register(self, address, ntimes=None):
+        if self.strict:
+            return self._next('read', address, ntimes).result
+
+        addrs = range(address, address + (1 if ntimes is None else ntimes))
+        if self._served is None or not self._served.isdisjoint(addrs):
+            self._advance(addrs)
+        self._served.update(addrs)
+
+        image = self._image
+        try:
+            if ntimes is None:
+                return image[address]
+            return [image[address + i] for i in range(ntimes)]
+        except KeyError as e:
+            raise ValueError('Address {} was never read in the replay '
+                             'log'.format(e.args[0]))
+
+    def _write_register(self, address, value):
+        if self.strict:
+            self._next('write', address, value)
+        else:
+            # the device now holds what was written, until the log says
+            # otherwise
+            self._apply(self._image, Transaction('write', address, value, None,
+                                                 0., 0.))
@@ -0,0 +1,176 @@
+from array import array
+
+from .register_state import RegisterState, _word_typecode
+from .timing import _spin_wait
+
+__all__ = ['SimulatedRegisterState', 'LatencyModel', 'SPI_LATENCY',
+           'I2C_LATENCY']
+
+
+class LatencyModel:
+    """
+    A simple model of how long a bus transaction takes.
+
+    Parameters
+    ----------
+    per_transaction : float
+        Seconds of overhead for each transaction.
+    per_byte : float
+        Seconds for each byte moved (not counting the address/command).
+    """
+    def __init__(self, per_transaction=0., per_byte=0.):
+        self.per_transaction = per_transaction
+        self.per_byte = per_byte
+
+    def __call__(self, nbytes):
+        return self.per_transaction + self.per_byte*nbytes
+
+    def __repr__(self):
+        return '<LatencyModel per_transaction={} per_byte={}>'.format(
+            self.per_transaction, self.per_byte)
+
+
+# roughly a Raspberry Pi talking SPI at a few MHz, and I2C at 100 kHz, with
+# the block size limit in bytes
+SPI_LATENCY = LatencyModel(50e-6, 1e-6)
+I2C_LATENCY = LatencyModel(400e-6, 90e-6)
+
+_BUS_DEFAULTS = {
+    'spi': (SPI_LATENCY, None),
+    'i2c': (I2C_LATENCY, 32),
+    None: (LatencyModel(), None),
+}
+
+
+class SimulatedRegisterState(RegisterState):
+    """
+    A `RegisterState` backed by memory, for testing and benchmarking without
+    hardware.
+
+    Parameters
+    ----------
+    naddresses : int
+        The number of addresses in the simulated device.
+    bus : 'spi', 'i2c', or None
+        The kind of bus to mimic.  Sets the default latency, the block size
+        limit (32 bytes for i2c), and the cost model used for read planning.
+    latency : callable or None
+        Given the number of bytes moved, returns the seconds a transaction
+        takes (e.g., a `LatencyModel`).  If None, use the default for ``bus``.
+    sleep : bool
+        If True, actually wait for the latency of each transaction.  If False,
+        only add it up in `simulated_time`.
+    read_only : iterable of int
+        Addresses that ignore writes.
+    volatile : dict
+        Maps addresses to a callable that is given the address and returns a
+        new value each time it is read.
+    initial : sequence of int or dict
+        Initial contents, either starting at address 0 or as address: value.
+    """
+    def __init__(self, registers, naddresses=256, bus=None, latency=None,
+                 sleep=False, read_only=(), volatile=None, initial=None,
+                 register_size=8, threadsafe=False):
+        if bus not in _BUS_DEFAULTS:
+            raise ValueError('bus must be "spi", "i2c", or None, not '
+                             '{}'.format(bus))
+        default_latency, max_block_bytes = _BUS_DEFAULTS[bus]
+
+        super().__init__(registers, register_size, threadsafe)
+        if max_block_bytes is not None:
+            self._max_block_size = max_block_bytes // self._word_bytes
+
+        self.bus = bus
+        self.latency = default_latency if latency is None else latency
+        if (isinstance(self.latency, LatencyModel) and
+                (self.latency.per_transaction or self.latency.per_byte)):
+            # give the read planner the same costs, in microseconds (a
+            # zero-cost model keeps the defaults, which still group reads)
+            self._transaction_cost = self.latency.per_transaction*1e6
+            self._byte_cost = self.latency.per_byte*1e6
+        self.sleep = sleep
+        self.read_only = frozenset(read_only)
+        self.volatile = {} if volatile is None else dict(volatile)
+
+        if register_size <= 8:
+            self._memory = bytearray(naddresses)
+        else:
+            self._memory = array(_word_typecode(register_size), [0]*naddresses)
+
+        if initial is not None:
+            items = initial.items() if isinstance(initial, dict) else enumerate(initial)
+            for addr, val in items:
+                self._memory[addr] = val
+
+        self.reset_counters()
+
+    @property
+    def memory(self):
+        """
+        The underlying memory of the simulated device.
+        """
+        return self._memory
+
+    def reset_counters(self):
+        self.read_transactions = 0
+        self.write_transactions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.simulated_time = 0.
+
+    @property
+    def transactions(self):
+        return self.read_transactions + self.write_transactions
+
+    def _transaction(self, nwords):
+        dt = self.latency(nwords*self._word_bytes)
+        self.simulated_time += dt
+        if self.sleep and dt > 0:
+            _spin_wait(dt)
+
+    def _check_range(self, address, n):
+        if self._max_block_size is not None and n > self._max_block_size:
+            raise ValueError('{} cannot move more than {} words at once, asked '
+                             'for {}'.format(self.bus, self._max_block_size, n))
+        if address < 0 or address + n > len(self._memory):
+            raise ValueError('Address range {}-{} is outside the simulated '
+                             'device'.format(address, address + n - 1))
+
+    def _start_read(self, address, n):
+        self._check_range(address, n)
+
+        mem = self._memory
+        for addr in self.volatile:
+            if address <= addr < address + n:
+                mem[addr] = self.volatile[addr](addr)
+
+        self.read_transactions += 1
+        self.bytes_read += n*self._word_bytes
+        self._transaction(n)
+
+    def _read_register(self, address, ntimes=None):
+        n = 1 if ntimes is None else ntimes
+        self._start_read(address, n)
+
+        if ntimes is None:
+            return self._memory[address]
+        else:
+            return list(self._memory[address:address + n])
+
+    def _read_into(self, address, buf):
+        n = len(buf)
+        self._start_read(address, n)
+        buf[:] = memoryview(self._memory)[address:address + n]
+
+    def _write_register(self, address, value):
+        values = [value] if isinstance(value, int) else value
+        self._check_range(address, len(values))
+
+        mem = self._memory
+        for i, val in enumerate(values):
+            if (address + i) not in self.read_only:
+                mem[address + i] = val
+
+        self.write_transactions += 1
+        self.bytes_written += len(values)*self._word_bytes
+        self._transaction(len(values))
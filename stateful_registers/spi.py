@@ -1,8 +1,11 @@
+import sys
+
 try:
     import spidev
 except ImportError:
     spidev = None
 
+from .bus import default_bus_manager
 from .register_state import RegisterState
 
 __all__ = ['SPIRegisterState']
@@ -18,16 +21,32 @@ class SPIRegisterState(RegisterState):
         it is unset for write and set for read.
     max_speed_hz : int or None
         The speed of the SPI bus or None to use default
+    byteorder : 'big' or 'little'
+        The byte order of words wider than 8 bits (``register_size`` > 8),
+        which are moved as ``register_size // 8`` bytes each.
+    bus_manager : BusManager or None
+        The manager to get the shared ``SpiDev`` handle and bus lock from.  If
+        None, use ``default_bus_manager``.
     """
+    # the clock is fast enough that the ioctl/Python overhead of each transfer
+    # dominates over the bytes themselves
+    _transaction_cost = 50.
+    _byte_cost = 1.
+
     def __init__(self, registers, spi_bus, spi_device, register_size=8,
-                 write_bit=7, write_set=True, max_speed_hz=None):
+                 write_bit=7, write_set=True, max_speed_hz=None,
+                 bus_manager=None, threadsafe=False, byteorder='big'):
         if spidev is None:
             raise ImportError('spidev not present, cannot use SPIRegisterState')
 
-        super().__init__(registers, register_size)
+        super().__init__(registers, register_size, threadsafe, byteorder)
+        self._bus_key = ('spi', spi_bus)
 
-        self.spi = spidev.SpiDev()
-        self.spi.open(spi_bus, spi_device)
+        if bus_manager is None:
+            bus_manager = default_bus_manager
+        self._bus_manager = bus_manager
+        self._handle_key = ('spi', spi_bus, spi_device)
+        self.spi, self._bus_lock = bus_manager.get_spi(spi_bus, spi_device)
         if max_speed_hz is not None:
             self.spi.max_speed_hz = max_speed_hz
 
@@ -36,18 +55,69 @@ class SPIRegisterState(RegisterState):
         self._write_bit = write_bit
         self.write_set = write_set
 
+        # transfer lists for _read_into, by burst length
+        self._read_xfers = {}
+
+    def close(self):
+        """
+        Releases this state's reference to the shared ``SpiDev`` handle.
+        """
+        if self.spi is not None:
+            self._bus_manager.release(self._handle_key)
+            self.spi = None
+        super().close()
+
     def _read_register(self, address, ntimes=None):
-        if ntimes is None:
-            return self.spi.xfer([self._read_command(address), 0])[1]
+        wb = self._word_bytes
+        if wb == 1:
+            if ntimes is None:
+                with self._bus_lock:
+                    return self.spi.xfer([self._read_command(address), 0])[1]
+            else:
+                with self._bus_lock:
+                    return self.spi.xfer2([self._read_command(address)] + [0]*ntimes)[1:]
+
+        n = 1 if ntimes is None else ntimes
+        with self._bus_lock:
+            buf = self.spi.xfer2([self._read_command(address)] + [0]*(n*wb))[1:]
+        words = self._unpack_words(buf)
+        return words[0] if ntimes is None else words
+
+    def _read_into(self, address, buf):
+        # spidev returns a new list for the reply, but the list sent can be
+        # reused for every burst of the same length (only the command
+        # changes), which saves building it each time
+        n = len(buf)
+        wb = self._word_bytes
+        xfer = self._read_xfers.get(n)
+        if xfer is None:
+            xfer = self._read_xfers[n] = [0]*(1 + n*wb)
+
+        with self._bus_lock:
+            xfer[0] = self._read_command(address)
+            reply = self.spi.xfer2(xfer)
+        if wb == 1:
+            buf[:] = bytes(reply[1:])
+        elif wb in (2, 4, 8) and self.byteorder == sys.byteorder:
+            buf.cast('B')[:] = bytes(reply[1:])
         else:
-            return self.spi.xfer2([self._read_command(address)] + [0]*ntimes)[1:]
+            words = self._unpack_words(reply[1:])
+            for i in range(n):
+                buf[i] = words[i]
 
     def _write_register(self, address, value):
-        if isinstance(value, int):
-            self.spi.xfer([self._write_command(address), value])
+        if self._word_bytes > 1:
+            values = [value] if isinstance(value, int) else value
+            with self._bus_lock:
+                self.spi.xfer2([self._write_command(address)] +
+                               list(self._pack_words(values)))
+        elif isinstance(value, int):
+            with self._bus_lock:
+                self.spi.xfer([self._write_command(address), value])
         else:
             # assume multi-write
-            self.spi.xfer2([self._write_command(address)] + value)
+            with self._bus_lock:
+                self.spi.xfer2([self._write_command(address)] + list(value))
 
     @property
     def write_bit(self):
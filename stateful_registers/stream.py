@@ -0,0 +1,211 @@
+"""
+Continuous acquisition of a fixed set of registers into a ring buffer.
+"""
+import threading
+import time
+
+from array import array
+
+from .register_state import _word_typecode
+from .timing import _Pacer
+
+__all__ = ['RegisterStream']
+
+
+class RegisterStream:
+    """
+    Reads a fixed set of registers at a steady rate from a background thread,
+    into a preallocated ring buffer of raw words.
+
+    The burst plan is worked out once up front, and each burst is read
+    straight into its slot of the ring buffer (see
+    `RegisterState._read_into`), so the acquisition loop does no per-sample
+    bookkeeping beyond the bus reads themselves.
+
+    Parameters
+    ----------
+    state : RegisterState
+        The state to read from.
+    registers : sequence or None
+        The registers (or names) to read, or None for all of them.
+    rate : float
+        Target samples per second.
+    capacity : int
+        Number of samples the ring buffer holds.  If the consumer falls this
+        far behind, the oldest samples are dropped (see `overruns`).
+    block_size : int
+        Number of samples per block yielded by `raw_blocks`/`blocks`.
+    groupread : bool or 'auto'
+        How to group the addresses into bursts, as in
+        `RegisterState.read_state`.  If True, all the words between the lowest
+        and highest address are read in one burst.
+
+    Examples
+    --------
+    ::
+
+        with RegisterStream(state, ['temp', 'press'], rate=200) as stream:
+            for block in stream.blocks():
+                process(block['temp'])
+    """
+    def __init__(self, state, registers=None, rate=100., capacity=1024,
+                 block_size=64, groupread='auto'):
+        if block_size > capacity:
+            raise ValueError('block_size cannot be larger than capacity')
+
+        self.state = state
+        if registers is not None:
+            registers = [state.get_register(r) if isinstance(r, str) else r
+                         for r in registers]
+        self.registers = registers
+        self.rate = rate
+        self.capacity = capacity
+        self.block_size = block_size
+
+        self._plan = state._plan_for(state._addresses_of(registers), groupread)
+
+        # the columns of the buffer are the words of each burst, in order
+        self.addresses = [start + i for start, n in self._plan for i in range(n)]
+        self.nwords = len(self.addresses)
+
+        typecode = _word_typecode(state.register_size)
+        self._buffer = array(typecode, bytes(capacity*self.nwords*array(typecode).itemsize))
+        self._timestamps = array('d', bytes(capacity*8))
+
+        self._cond = threading.Condition()
+        self._written = 0
+        self._consumed = 0
+        self._thread = None
+        self._running = False
+        self.overruns = 0
+        self.late = 0
+        self.error = None
+
+    def start(self):
+        """
+        Starts acquiring in a background thread.
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._acquire, daemon=True,
+                                        name='RegisterStream')
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops acquiring, waiting for the current sample to finish.
+        """
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def running(self):
+        return self._running
+
+    def _acquire(self):
+        read_into = self.state._read_into
+        timestamps = self._timestamps
+        capacity = self.capacity
+        clock = time.perf_counter
+
+        # views of where each burst goes in each slot, so the reads go
+        # straight into the ring buffer
+        view = memoryview(self._buffer)
+        slot_bursts = []
+        for slot in range(capacity):
+            bursts = []
+            offset = slot*self.nwords
+            for start, n in self._plan:
+                bursts.append((start, view[offset:offset + n]))
+                offset += n
+            slot_bursts.append(bursts)
+
+        pacer = _Pacer(self.rate, clock)
+        try:
+            while self._running:
+                with self._cond:
+                    # drop the oldest sample before overwriting its slot, so
+                    # a reader never copies a half-written one
+                    if self._written - self._consumed >= capacity:
+                        self._consumed = self._written - capacity + 1
+                        self.overruns += 1
+                slot = self._written % capacity
+                timestamps[slot] = clock()
+                for start, burst_view in slot_bursts[slot]:
+                    read_into(start, burst_view)
+
+                with self._cond:
+                    self._written += 1
+                    self._cond.notify_all()
+
+                if not pacer.wait():
+                    self.late += 1
+        except Exception as e:
+            self.error = e
+            self._running = False
+            with self._cond:
+                self._cond.notify_all()
+
+    def raw_blocks(self, timeout=None):
+        """
+        Yields ``(timestamps, raw)`` for each block of ``block_size`` samples,
+        until the stream is stopped (at which point a final partial block may
+        be yielded).  ``timestamps`` is an array of `time.perf_counter` values,
+        and ``raw`` is a flat array of ``len(timestamps) * nwords`` words, one
+        row per sample with columns given by `addresses`.
+        """
+        capacity = self.capacity
+        nwords = self.nwords
+        while True:
+            with self._cond:
+                ready = self._cond.wait_for(
+                    lambda: (self._written - self._consumed >= self.block_size
+                             or not self._running), timeout)
+                if not ready:
+                    return
+                n = min(self._written - self._consumed, self.block_size)
+                if n == 0:
+                    if self.error is not None:
+                        raise self.error
+                    return
+
+                first = self._consumed % capacity
+                slots = [(first, min(first + n, capacity))]
+                if first + n > capacity:
+                    slots.append((0, first + n - capacity))
+                timestamps = array('d')
+                raw = array(self._buffer.typecode)
+                for lo, hi in slots:
+                    timestamps.extend(self._timestamps[lo:hi])
+                    raw.extend(self._buffer[lo*nwords:hi*nwords])
+                self._consumed += n
+            yield timestamps, raw
+
+    def blocks(self, timeout=None):
+        """
+        Like `raw_blocks`, but yields each block decoded into a numpy
+        structured array (see `decode_snapshots`) with an added ``'time'``
+        field.  Requires numpy.
+        """
+        from .arrays import np, decode_snapshots, _with_time
+
+        if np is None:
+            raise ImportError('numpy not present, cannot decode stream blocks')
+
+        for timestamps, raw in self.raw_blocks(timeout):
+            raw = np.frombuffer(raw, dtype=raw.typecode).reshape(-1, self.nwords)
+            decoded = decode_snapshots(self.state, raw, self.addresses,
+                                       self.registers)
+            yield _with_time(timestamps, decoded)
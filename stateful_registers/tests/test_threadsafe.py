@@ -0,0 +1,68 @@
+import threading
+import time
+
+from .. import i2c
+from ..bus import BusManager
+from ..register_state import RegisterValue
+
+
+class FakeSMBus:
+    """
+    Just enough of ``smbus.SMBus`` for `I2CRegisterState`, slow enough that
+    two threads overlap.
+    """
+    def __init__(self, bus):
+        self.memory = {}
+
+    def read_byte_data(self, device, address):
+        time.sleep(1e-4)
+        return self.memory.get(address, 0)
+
+    def read_i2c_block_data(self, device, address, n):
+        time.sleep(1e-4)
+        return [self.memory.get(address + i, 0) for i in range(n)]
+
+    def write_byte_data(self, device, address, value):
+        self.memory[address] = value
+
+    def write_i2c_block_data(self, device, address, values):
+        for i, value in enumerate(values):
+            self.memory[address + i] = value
+
+    def close(self):
+        pass
+
+
+class FakeSMBusModule:
+    SMBus = FakeSMBus
+
+
+def test_poll_and_read_state_do_not_deadlock(monkeypatch):
+    monkeypatch.setattr(i2c, 'smbus', FakeSMBusModule)
+    manager = BusManager()
+    regs = [RegisterValue('a', 0, nbits=8), RegisterValue('b', 1, nbits=8),
+            RegisterValue('c', 5, nbits=8)]
+    state = i2c.I2CRegisterState(regs, 0x40, bus_manager=manager,
+                                 threadsafe=True)
+
+    errors = []
+
+    def run(func):
+        try:
+            for i in range(200):
+                func()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=run, args=(
+            lambda: manager.poll([state], lambda st: st.read_state()),),
+            daemon=True),
+        threading.Thread(target=run, args=(state.read_state,), daemon=True)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+
+    assert not any(t.is_alive() for t in threads), 'threads deadlocked'
+    assert not errors
@@ -0,0 +1,42 @@
+"""
+Small helpers for waiting at bus timescales, shared by the simulated and
+replayed backends and the polling loops.
+"""
+import time
+
+__all__ = []
+
+
+def _spin_wait(seconds):
+    """
+    Waits for ``seconds`` by busy-waiting, since `time.sleep` is too coarse
+    for bus-scale latencies.
+    """
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class _Pacer:
+    """
+    Keeps a polling loop running ``rate`` times per second, timed by
+    ``clock``.
+    """
+    def __init__(self, rate, clock=time.perf_counter):
+        self.period = 1. / rate
+        self.clock = clock
+        self.next_time = clock()
+
+    def wait(self):
+        """
+        Sleeps until the next cycle is due.  Returns False if it was already
+        late, in which case the schedule starts over from now rather than
+        trying to catch up, which would just make a burst.
+        """
+        self.next_time += self.period
+        delay = self.next_time - self.clock()
+        if delay > 0:
+            time.sleep(delay)
+            return True
+        self.next_time = self.clock()
+        return False